@@ -1,4 +1,6 @@
 import argparse
+import sys
+import time
 
 from .orchestrator import Orchestrator
 
@@ -14,11 +16,41 @@ def run(orchestrator, args):
         print("Container '{}' created".format(name))
 
 
+def build(orchestrator, args):
+    tag = orchestrator.build(args.config, args.force)
+    print("Image '{}' ready".format(tag))
+
+
+def run_batch(orchestrator, args):
+    start = time.perf_counter()
+    results = orchestrator.run_batch(args.configs, args.workers)
+    for result in results:
+        if result["error"] is None:
+            print("{}: container '{}' ready in {:.2f}s".format(result["config"], result["container"], result["seconds"]))
+        else:
+            print("{}: failed after {:.2f}s: {}".format(result["config"], result["seconds"], result["error"]))
+    failed = sum(result["error"] is not None for result in results)
+    print("{} started, {} failed in {:.2f}s".format(len(results) - failed, failed, time.perf_counter() - start))
+
+
+def status(orchestrator, args):
+    for state in orchestrator.status():
+        print("{:<20} {:<10} {}".format(state["container_name"], state["status"] or "unknown", state["script"]))
+
+
 def logs(orchestrator, args):
-    logs = orchestrator.logs(args.container_name)
-    if logs:
-        print("Container '{}' logged".format(args.container_name))
-        print(logs)
+    if args.archived:
+        for line in orchestrator.archived_logs(args.container_name, args.since, args.until):
+            sys.stdout.write(line)
+        return
+    chunks = orchestrator.stream_logs(args.container_name, tail=args.tail if args.tail is not None else "all",
+                                      since=args.since, until=args.until, follow=args.follow)
+    if chunks is None:
+        print("Container '{}' not found".format(args.container_name))
+        return
+    for chunk in chunks:
+        sys.stdout.write(chunk)
+        sys.stdout.flush()
 
 def main():
     orchestrator = Orchestrator()
@@ -33,9 +65,30 @@ def main():
     run_parser.add_argument("--filename", type=str, help="Path to the file to process")
     run_parser.set_defaults(func=run)
 
+    # Subcommand: build
+    build_parser = subparsers.add_parser("build", help="Build the image of a config's requirements")
+    build_parser.add_argument("config", type=str, help="Path to the configuration file")
+    build_parser.add_argument("--force", action="store_true", help="Rebuild even if the image exists")
+    build_parser.set_defaults(func=build)
+
+    # Subcommand: run-batch
+    run_batch_parser = subparsers.add_parser("run-batch", help="Run many configs concurrently")
+    run_batch_parser.add_argument("configs", type=str, nargs="+", help="Paths to the configuration files")
+    run_batch_parser.add_argument("--workers", type=int, default=8, help="Maximum containers launched at once")
+    run_batch_parser.set_defaults(func=run_batch)
+
+    # Subcommand: status
+    status_parser = subparsers.add_parser("status", help="Show the status of every started container")
+    status_parser.set_defaults(func=status)
+
     # Subcommand: logs
     logs_parser = subparsers.add_parser("logs", help="Show logs for container")
     logs_parser.add_argument("container_name", type=str, help="Name of the container")
+    logs_parser.add_argument("--tail", type=int, help="Only show the last N lines")
+    logs_parser.add_argument("--since", type=float, help="Only show logs after this epoch timestamp")
+    logs_parser.add_argument("--until", type=float, help="Only show logs before this epoch timestamp")
+    logs_parser.add_argument("--follow", "-f", action="store_true", help="Keep streaming new logs")
+    logs_parser.add_argument("--archived", action="store_true", help="Read the log archive instead of the container")
     logs_parser.set_defaults(func=logs)
 
     # Subcommand: remove
@@ -0,0 +1,262 @@
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterable, Iterator, List, Tuple
+
+# index entry of a block: first and last timestamp, offset and compressed length in the segment
+ENTRY = struct.Struct("<ddQQ")
+
+
+def parse_timestamp(value: bytes) -> float:
+    """Epoch seconds of a Docker log timestamp, RFC 3339 in UTC with up to nanoseconds."""
+    seconds, _, fraction = value.decode().rstrip("Z").partition(".")
+    # parsed by hand, `fromisoformat` only takes microseconds and no `Z` before Python 3.11
+    timestamp = datetime.fromisoformat(seconds).replace(tzinfo=timezone.utc).timestamp()
+    return timestamp + float(f"0.{fraction}") if fraction else timestamp
+
+
+def line_timestamp(line: bytes) -> float | None:
+    """Timestamp Docker prefixed a line with, None for a line without one, like the rest of a line split in two."""
+    try:
+        return parse_timestamp(line[:line.index(b" ")])
+    except ValueError:
+        return None
+
+
+class LogArchive:
+    """
+    Container logs on disk, one directory per container, in segments of compressed blocks.
+
+    Lines are kept with the timestamp Docker prefixes them with. Each block is a complete gzip member of at most about
+    `block_size` bytes of lines, so it can be decompressed on its own; a segment is a file of blocks, named after its
+    first timestamp, with an index file holding the time range and offset of each block. A time range read only opens
+    the segments that overlap it, and only decompresses the blocks that do. Segments rotate once they reach
+    `segment_size` compressed bytes, and only the last `keep` are kept, if set.
+    """
+
+    def __init__(self,
+                 directory: str | os.PathLike,
+                 segment_size: int = 64 * 2 ** 20,
+                 block_size: int = 256 * 2 ** 10,
+                 flush_interval: float = 1.0,
+                 keep: int | None = None,
+                 level: int = 3,
+                 ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_size = segment_size
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+        self.keep = keep
+        self.level = level
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def lock(self, name: str) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(name, threading.Lock())
+
+    def segments(self, name: str) -> List[Tuple[float, Path]]:
+        """The segments of a container, as (first timestamp, path), oldest first."""
+        directory = self.directory / name
+        if not directory.is_dir():
+            return []
+        return sorted((float(path.stem), path) for path in directory.glob("*.gz"))
+
+    @staticmethod
+    def _index(segment: Path) -> List[Tuple[float, float, int, int]]:
+        data = segment.with_suffix(".idx").read_bytes()
+        # a partially written entry is dropped, its block is rewritten after a restart
+        return list(ENTRY.iter_unpack(data[:len(data) - len(data) % ENTRY.size]))
+
+    def last(self, name: str) -> float | None:
+        """Timestamp of the last archived line of a container."""
+        for _, segment in reversed(self.segments(name)):
+            index = self._index(segment)
+            if index:
+                return index[-1][1]
+        return None
+
+    def write(self, name: str, chunks: Iterable[bytes], after: float | None = None) -> float | None:
+        """
+        Archive timestamped log output until `chunks` ends, skipping lines up to `after`. Returns the last archived
+        timestamp. Lines are parsed only at block boundaries, so the cost is mostly compression.
+        """
+        with self.lock(name):
+            writer = _SegmentWriter(self, name)
+            buffer = bytearray()
+            started = time.monotonic()
+            try:
+                for chunk in chunks:
+                    if after is not None:
+                        chunk = self._skip(chunk, after)
+                        if not chunk:
+                            continue
+                        after = None
+                    buffer += chunk
+                    if len(buffer) >= self.block_size or time.monotonic() - started >= self.flush_interval:
+                        end = buffer.rfind(b"\n") + 1
+                        if end:
+                            writer.block(bytes(buffer[:end]))
+                            del buffer[:end]
+                        started = time.monotonic()
+            finally:
+                if buffer:
+                    # output that stopped mid-line still gets archived
+                    writer.block(bytes(buffer) if buffer.endswith(b"\n") else bytes(buffer) + b"\n")
+                writer.close()
+            return writer.last
+
+    @staticmethod
+    def _skip(chunk: bytes, after: float) -> bytes:
+        # a resumed stream starts at the last archived second, drop what is already archived
+        start = 0
+        while start < len(chunk):
+            end = chunk.find(b"\n", start) + 1 or len(chunk)
+            timestamp = line_timestamp(chunk[start:end])
+            # a line without a timestamp continues one that was skipped
+            if timestamp is not None and timestamp > after:
+                return chunk[start:]
+            start = end
+        return b""
+
+    def read(self, name: str, since: float | None = None, until: float | None = None) -> Iterator[str]:
+        """Archived lines of a container between two epoch timestamps, with their timestamps, oldest first."""
+        since = since if since is not None else float("-inf")
+        until = until if until is not None else float("inf")
+        segments = self.segments(name)
+        for i, (first, segment) in enumerate(segments):
+            following = segments[i + 1][0] if i + 1 < len(segments) else float("inf")
+            if first > until or following < since:
+                continue
+            with open(segment, "rb") as f:
+                for block_first, block_last, offset, length in self._index(segment):
+                    if block_first > until or block_last < since:
+                        continue
+                    f.seek(offset)
+                    lines = zlib.decompress(f.read(length), 31).decode("utf-8", errors="replace").splitlines(True)
+                    if since <= block_first and block_last <= until:
+                        yield from lines
+                    else:
+                        yield from self._between(lines, block_first, since, until)
+
+    @staticmethod
+    def _between(lines: List[str], first: float, since: float, until: float) -> Iterator[str]:
+        timestamp = first
+        for line in lines:
+            # a line without a timestamp goes with the line before it
+            parsed = line_timestamp(line.encode())
+            timestamp = parsed if parsed is not None else timestamp
+            if since <= timestamp <= until:
+                yield line
+
+
+class _SegmentWriter:
+    def __init__(self, archive: LogArchive, name: str):
+        self.archive = archive
+        self.directory = archive.directory / name
+        self.directory.mkdir(exist_ok=True)
+        self.data = None
+        self.index = None
+        self.last = None
+        segments = archive.segments(name)
+        if segments and segments[-1][1].stat().st_size < archive.segment_size:
+            self._open(segments[-1][1])
+
+    def _open(self, segment: Path):
+        self.data = open(segment, "ab")
+        self.index = open(segment.with_suffix(".idx"), "ab")
+
+    def block(self, lines: bytes):
+        first = line_timestamp(lines)
+        last = line_timestamp(lines[lines.rfind(b"\n", 0, len(lines) - 1) + 1:])
+        if first is None or last is None:
+            # lines without a timestamp of their own are indexed by those around them, or when they were archived
+            stamps = [timestamp for timestamp in map(line_timestamp, lines.splitlines()) if timestamp is not None]
+            fallback = self.last if self.last is not None else time.time()
+            first = stamps[0] if stamps else fallback
+            last = stamps[-1] if stamps else fallback
+        self.last = last
+        if self.data is None or self.data.tell() >= self.archive.segment_size:
+            self._rotate(first)
+        compressor = zlib.compressobj(self.archive.level, zlib.DEFLATED, 31)
+        compressed = compressor.compress(lines) + compressor.flush()
+        offset = self.data.tell()
+        self.data.write(compressed)
+        self.data.flush()
+        # the index entry is written after its block, so an entry always points to a complete block
+        self.index.write(ENTRY.pack(first, self.last, offset, len(compressed)))
+        self.index.flush()
+
+    def _rotate(self, first: float):
+        self.close()
+        self._open(self.directory / f"{first:.6f}.gz")
+        if self.archive.keep is not None:
+            for _, segment in self.archive.segments(self.directory.name)[:-self.archive.keep]:
+                segment.unlink()
+                segment.with_suffix(".idx").unlink(missing_ok=True)
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.index.close()
+            self.data = self.index = None
+
+
+class LogArchiver:
+    """
+    Copies the output of containers into a `LogArchive` from the daemon's log stream, one thread per followed
+    container. A followed container is archived until it stops; following it again resumes after the last archived
+    line. `drain` catches up on a container's output before it is removed.
+    """
+
+    def __init__(self, client, archive: LogArchive):
+        self.client = client
+        self.archive = archive
+        self.threads = {}
+        self.streams = {}
+        self.lock = threading.Lock()
+
+    def _archive(self, name: str, follow: bool):
+        from docker.errors import DockerException
+        from requests.exceptions import RequestException
+
+        since = self.archive.last(name)
+        try:
+            stream = self.client.api.logs(name, stdout=True, stderr=True, stream=True, follow=follow,
+                                          timestamps=True, since=since)
+        except DockerException:
+            return
+        self.streams[name] = stream
+        try:
+            self.archive.write(name, stream, after=since)
+        except (RequestException, OSError):
+            pass
+        finally:
+            self.streams.pop(name, None)
+            stream.close()
+
+    def follow(self, name: str):
+        with self.lock:
+            thread = self.threads.get(name)
+            if thread is not None and thread.is_alive():
+                return
+            thread = threading.Thread(target=self._archive, args=(name, True), daemon=True)
+            self.threads[name] = thread
+            thread.start()
+
+    def drain(self, name: str):
+        """Archive all of a container's output so far, blocking until done."""
+        with self.lock:
+            thread = self.threads.pop(name, None)
+        stream = self.streams.get(name)
+        if stream is not None:
+            # the follower stops at the next chunk, what it buffered is written as it exits
+            stream.close()
+        if thread is not None:
+            thread.join()
+        self._archive(name, follow=False)
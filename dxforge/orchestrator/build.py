@@ -0,0 +1,112 @@
+import hashlib
+import io
+import os
+import tarfile
+import threading
+from typing import List
+
+REPOSITORY = "dxforge-env"
+LABEL_BASE = "dxforge.base"
+LABEL_REQUIREMENTS_HASH = "dxforge.requirements_hash"
+
+# the requirements are copied on their own, so the install layer is only invalidated when they change
+DOCKERFILE = """\
+FROM {base}
+COPY requirements.txt /dxforge/requirements.txt
+RUN python3 -m pip install --no-cache-dir -r /dxforge/requirements.txt
+"""
+
+_built = set()  # tags known to exist, so launches skip the image lookup
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def requirements(cfg) -> List[str]:
+    """
+    The requirements of a config, from `container.requirements`: either a list of requirement specifiers or the path
+    of a requirements file, relative to the script's directory. Comments and blank lines are dropped, and the result is
+    sorted, so reordering or commenting a file does not change the dependency set.
+    """
+    spec = cfg["container"].get("requirements")
+    if not spec:
+        return []
+    if isinstance(spec, str):
+        path = os.path.join(os.path.dirname(cfg["container"]["script"]), spec)
+        with open(path) as f:
+            spec = f.read().splitlines()
+    lines = (line.split("#", 1)[0].strip() for line in spec)
+    return sorted({line for line in lines if line})
+
+
+def image_hash(base: str, reqs: List[str]) -> str:
+    return hashlib.sha256("\n".join([base, *reqs]).encode()).hexdigest()
+
+
+def _context(base: str, reqs: List[str]) -> io.BytesIO:
+    files = {
+        "Dockerfile": DOCKERFILE.format(base=base).encode(),
+        "requirements.txt": "".join(f"{line}\n" for line in reqs).encode(),
+    }
+    context = io.BytesIO()
+    with tarfile.open(fileobj=context, mode="w") as tar:
+        for name, data in files.items():
+            # fixed metadata, so identical inputs give an identical context and hit the build cache
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mode = 0o644
+            tar.addfile(info, io.BytesIO(data))
+    context.seek(0)
+    return context
+
+
+def build(client, cfg, force: bool = False) -> str:
+    """
+    Build the image of a config unless an image with the same dependency hash exists, returning its tag.
+    Configs without requirements run in their base image as is.
+    """
+    from docker.errors import ImageNotFound
+
+    base = cfg["container"]["image"]
+    reqs = requirements(cfg)
+    if not reqs:
+        return base
+    digest = image_hash(base, reqs)
+    tag = f"{REPOSITORY}:{digest[:16]}"
+    if tag in _built and not force:
+        return tag
+
+    with _locks_lock:
+        lock = _locks.setdefault(tag, threading.Lock())
+    # concurrent launches of configs with the same dependencies wait on a single build
+    with lock:
+        if not force:
+            try:
+                client.images.get(tag)
+                _built.add(tag)
+                return tag
+            except ImageNotFound:
+                pass
+        print(f"Building image {tag} from {base} with {len(reqs)} requirements...")
+        client.images.build(
+            fileobj=_context(base, reqs),
+            custom_context=True,
+            tag=tag,
+            labels={LABEL_BASE: base, LABEL_REQUIREMENTS_HASH: digest},
+            rm=True,
+        )
+        _built.add(tag)
+        return tag
+
+
+def forget(client, tag: str) -> bool:
+    """Drop a tag from the known built images if it was removed since, returning whether it was."""
+    from docker.errors import ImageNotFound
+
+    if tag not in _built:
+        return False
+    try:
+        client.images.get(tag)
+        return False
+    except ImageNotFound:
+        _built.discard(tag)
+        return True
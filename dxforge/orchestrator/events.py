@@ -0,0 +1,126 @@
+import threading
+import time
+from typing import Callable, Dict, List
+
+# container event actions that change the status, others (exec, attach, kill...) leave it as it is
+STATUSES = {
+    "create": "created",
+    "start": "running",
+    "restart": "running",
+    "unpause": "running",
+    "pause": "paused",
+    "die": "exited",
+    "stop": "exited",
+}
+
+
+class ContainerCache:
+    """
+    Status of every container on the Docker host, kept up to date from the daemon's event stream so lookups do not
+    need an API call. The cache lists all containers once when it connects, and again whenever the stream drops,
+    since events may have been missed in between; `ready` is false until that listing is done.
+
+    `connect` returns the Docker client, it is called from the cache's thread so an unreachable daemon is retried
+    every `retry` seconds instead of failing the caller.
+    """
+
+    def __init__(self, connect: Callable, retry: float = 1.0):
+        self.connect = connect
+        self.client = None
+        self.retry = retry
+        self.containers: Dict[str, dict] = {}  # name -> {"id", "name", "status", "labels"}
+        self.names: Dict[str, str] = {}  # id -> name
+        self.lock = threading.Lock()
+        self.ready = False
+        self._events = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._events is not None:
+            self._events.close()
+        self._thread = None
+
+    def get(self, name: str) -> dict | None:
+        """The cached state of a container, by name or id."""
+        with self.lock:
+            state = self.containers.get(self.names.get(name, name))
+            return dict(state) if state is not None else None
+
+    def known(self, name: str) -> bool | None:
+        """Whether a container exists, or None when the cache cannot tell because it is not in sync."""
+        if not self.ready:
+            return None
+        return self.get(name) is not None
+
+    def list(self, labels: Dict[str, str] | None = None) -> List[dict]:
+        with self.lock:
+            return [
+                state for state in self.containers.values()
+                if all(state["labels"].get(key) == value for key, value in (labels or {}).items())
+            ]
+
+    def sync(self):
+        """Replace the cache with a fresh listing of every container."""
+        containers = self.client.api.containers(all=True)
+        with self.lock:
+            self.containers = {}
+            self.names = {}
+            for container in containers:
+                self._put(container["Id"], container["Names"][0].lstrip("/"), container["State"],
+                          container.get("Labels") or {})
+
+    def _put(self, container_id: str, name: str, status: str, labels: dict):
+        self.containers[name] = {"id": container_id, "name": name, "status": status, "labels": labels}
+        self.names[container_id] = name
+
+    def apply(self, event: dict):
+        action = event.get("Action", "")
+        container_id = event.get("id") or event["Actor"]["ID"]
+        attributes = dict(event.get("Actor", {}).get("Attributes", {}))
+        name = attributes.pop("name", None)
+        with self.lock:
+            if action == "destroy":
+                name = self.names.pop(container_id, name)
+                self.containers.pop(name, None)
+            elif action == "rename":
+                old = self.names.get(container_id)
+                if old is not None and name is not None:
+                    self.containers[name] = self.containers.pop(old)
+                    self.containers[name]["name"] = name
+                    self.names[container_id] = name
+            elif action in STATUSES and name is not None:
+                state = self.containers.get(name)
+                if state is None or state["id"] != container_id:
+                    # the remaining attributes of a container event are its labels, plus the image
+                    attributes.pop("image", None)
+                    self._put(container_id, name, STATUSES[action], attributes)
+                else:
+                    state["status"] = STATUSES[action]
+
+    def _run(self):
+        from docker.errors import DockerException
+        from requests.exceptions import RequestException
+
+        while not self._stop.is_set():
+            try:
+                self.client = self.connect()
+                # subscribe before listing, so nothing that happens during the listing is missed
+                since = int(time.time())
+                self._events = self.client.events(decode=True, filters={"type": "container"}, since=since)
+                self.sync()
+                self.ready = True
+                for event in self._events:
+                    self.apply(event)
+            except (DockerException, RequestException, OSError):
+                pass
+            finally:
+                self.ready = False
+            self._stop.wait(self.retry)
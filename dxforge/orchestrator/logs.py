@@ -1,18 +1,67 @@
+import codecs
 import sys
 
-from docker import from_env
-from docker.errors import DockerException
 
+def logs(client, name, cache=None):
+    from docker.errors import DockerException
 
-def logs(client, name):
+    if cache is not None and cache.known(name) is False:
+        return None
     try:
-        container = client.containers.get(name)
-        return container.logs(stdout=True, stderr=True).decode("utf-8")
+        return client.api.logs(name, stdout=True, stderr=True).decode("utf-8")
     except DockerException as e:
         return None
 
 
+def stream_logs(client, name, tail="all", since=None, until=None, follow=False, cache=None):
+    """
+    A container's logs as a generator of text chunks, read from the daemon as they are consumed, so memory use does
+    not depend on the size of the log. `tail` keeps the last N lines, `since` and `until` are epoch seconds or
+    datetimes, and `follow` keeps the stream open for new output. Returns None if the container does not exist.
+    """
+    from docker.errors import DockerException
+
+    if cache is not None and cache.known(name) is False:
+        return None
+    try:
+        # the request is made here, so a missing container is reported before streaming starts
+        stream = client.api.logs(name, stdout=True, stderr=True, stream=True,
+                                 tail=tail, since=since, until=until, follow=follow)
+    except DockerException:
+        return None
+    return LogStream(stream)
+
+
+class LogStream:
+    """Text chunks of a Docker log stream. `close` may be called from another thread, to end a blocked read."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def __iter__(self):
+        return _decode(self.stream)
+
+    def close(self):
+        self.stream.close()
+
+
+def _decode(stream):
+    # chunks can end in the middle of a multi-byte character, the decoder keeps it until the next one
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    try:
+        for chunk in stream:
+            text = decoder.decode(chunk)
+            if text:
+                yield text
+        text = decoder.decode(b"", final=True)
+        if text:
+            yield text
+    finally:
+        stream.close()
+
+
 if __name__ == "__main__":
-    print(
-        logs(from_env(), sys.argv[1])
-    )
\ No newline at end of file
+    from docker import from_env
+
+    for chunk in stream_logs(from_env(), sys.argv[1]) or ():
+        sys.stdout.write(chunk)
@@ -1,7 +1,11 @@
-from docker import from_env
+import hashlib
+import threading
 
-from dxforge.orchestrator import logs, remove, run, stop
-from dxforge.registry.mesh import MeshInterface
+from dxforge.orchestrator import build, logs, remove, run, stop
+from dxforge.orchestrator.archive import LogArchive, LogArchiver
+from dxforge.orchestrator.placement import LABEL_CPUSET, Placement
+from dxforge.orchestrator.events import ContainerCache
+from dxforge.orchestrator.pool import WarmPool
 
 
 class SingletonMeta(type):
@@ -17,12 +21,140 @@ class SingletonMeta(type):
 class Orchestrator(metaclass=SingletonMeta):
     """Orchestrator class to manage service registrations and queries."""
     def __init__(self):
-        self.interface = MeshInterface()
-        self.client = from_env()
-        self.logs = lambda name: logs.logs(self.client, name)
-        self.remove = lambda name: remove.remove(self.client, name)
-        self.stop = lambda name: stop.stop(self.client, name)
+        self._interface = None
+        self.cache: ContainerCache | None = None
+        self.pools: dict[str, WarmPool] = {}
+        self.archiver: LogArchiver | None = None
+        self._drainer: LogArchiver | None = None
+        self._placement = None
+        self._pools_lock = threading.Lock()
+        self._lock = threading.Lock()  # for the placement and drainer, made on first use by concurrent launches
+        self.logs = lambda name: logs.logs(self.client, name, self.cache)
+        self.stream_logs = lambda name, **kwargs: logs.stream_logs(self.client, name, cache=self.cache, **kwargs)
+
+    @property
+    def client(self):
+        return run.get_client()
+
+    @property
+    def placement(self) -> Placement:
+        with self._lock:
+            if self._placement is None:
+                self._placement = Placement(self.client)
+            return self._placement
+
+    def _dedicated(self, name) -> bool:
+        """Whether a container has dedicated cores, from the cache when it is in sync."""
+        from docker.errors import DockerException
+
+        if self.cache is not None and self.cache.ready:
+            state = self.cache.get(name)
+            return state is not None and LABEL_CPUSET in state["labels"]
+        try:
+            return LABEL_CPUSET in (self.client.api.inspect_container(name)["Config"]["Labels"] or {})
+        except DockerException:
+            return False
+
+    def _rebalance(self):
+        from docker.errors import DockerException
+
+        try:
+            self.placement.rebalance()
+        except DockerException:
+            pass  # the next placement gives the cores back
+
+    def remove(self, name):
+        dedicated = self._dedicated(name)
+        removed = remove.remove(self.client, name, self.cache, self.drainer)
+        if removed and dedicated:
+            # its cores go back to the shared containers
+            self._rebalance()
+        return removed
+
+    def stop(self, name):
+        dedicated = self._dedicated(name)
+        stopped = stop.stop(self.client, name, self.cache)
+        if stopped and dedicated:
+            self._rebalance()
+        return stopped
+
+    @property
+    def interface(self):
+        if self._interface is None:
+            # the registry client pulls in the whole web stack, only import it when it is used
+            from dxforge.registry.mesh import MeshInterface
+            self._interface = MeshInterface()
+        return self._interface
+
+    def watch(self):
+        """Keep container statuses in memory from Docker events, for long-running processes like the scheduler."""
+        if self.cache is None:
+            self.cache = ContainerCache(run.get_client)
+            self.cache.start()
+
+    def archive(self, directory=None):
+        """
+        Archive the logs of every running container, and of those started from now on, into `directory`, by default
+        the state directory's `logs`.
+        """
+        if self.archiver is None:
+            self.archiver = LogArchiver(self.client, LogArchive(directory or run.get_state_dir() / "logs"))
+        for state in self.status():
+            if state["status"] == "running":
+                self.archiver.follow(state["container_name"])
+
+    @property
+    def drainer(self) -> LogArchiver:
+        """Where a container's logs go before it is removed, the default archive unless `archive` was called."""
+        if self.archiver is not None:
+            return self.archiver
+        with self._lock:
+            if self._drainer is None:
+                self._drainer = LogArchiver(self.client, LogArchive(run.get_state_dir() / "logs"))
+            return self._drainer
+
+    def archived_logs(self, name, since=None, until=None):
+        archive = self.archiver.archive if self.archiver is not None else LogArchive(run.get_state_dir() / "logs")
+        return archive.read(name, since, until)
+
+    def pool(self, config) -> WarmPool | None:
+        """The warm pool of a config's image, if the config asks for one with `container.pool: <size>`."""
+        size = config["container"].get("pool")
+        if not size:
+            return None
+        image = build.build(self.client, config)
+        with self._pools_lock:
+            if image not in self.pools:
+                directory = run.get_state_dir() / "pool" / hashlib.sha256(image.encode()).hexdigest()[:12]
+                self.pools[image] = WarmPool(self.client, image, directory, size, labels={run.LABEL_MANAGED: "true"})
+            return self.pools[image]
+
+    def close_pools(self):
+        """Remove the idle containers of every warm pool."""
+        with self._pools_lock:
+            pools, self.pools = self.pools, {}
+        for pool in pools.values():
+            pool.close()
+
+    def warm(self, config):
+        """Start filling the warm pool of a config's image in the background, if it has one."""
+        pool = self.pool(run.load_config(config))
+        if pool is not None:
+            pool.refill()
+
+    def build(self, config, force=False):
+        return build.build(self.client, run.load_config(config), force)
 
     def run(self, config):
         config = run.load_config(config)
-        return run.run(config)
+        name = run.run(config, self.cache, self.pool(config), self.drainer, self.placement)
+        if self.archiver is not None:
+            self.archiver.follow(name)
+        return name
+
+    def run_batch(self, configs, max_workers=8):
+        # each launch goes through `run`, so batches use the warm pools and the log archive too
+        return run.run_batch(configs, max_workers, launch=self.run)
+
+    def status(self):
+        return run.fleet_status(self.cache)
@@ -0,0 +1,248 @@
+import math
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Set
+
+NODES = Path("/sys/devices/system/node")
+
+LABEL_CPUSET = "dxforge.cpuset"
+LABEL_ALLOWED = "dxforge.cpuset_allowed"
+LABEL_PRIORITY = "dxforge.priority"
+LABEL_CPUS = "dxforge.cpus"
+
+# priority classes: latency containers get dedicated cores, the others share the cores nobody has dedicated
+PRIORITIES = {
+    "latency": {"dedicated": True, "cpu_shares": 2048},
+    "normal": {"dedicated": False, "cpu_shares": 1024},
+    "batch": {"dedicated": False, "cpu_shares": 256},
+}
+FIELDS = ("cpus", "cpuset", "memory", "numa_node", "priority", "cpu_quota", "mem_limit")
+# CFS period Docker uses unless `cpu_period` is set, to read older configs' `cpu_quota`
+CPU_PERIOD = 100000
+ACTIVE = ("created", "running", "restarting", "paused")
+
+
+class PlacementError(Exception):
+    """Raised when a launch would oversubscribe dedicated cores."""
+
+
+def parse_cpulist(text: str) -> List[int]:
+    """CPUs of a list like `0-3,8,10-11`, the format of cpusets and /sys."""
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        start, _, end = part.partition("-")
+        cpus.extend(range(int(start), int(end or start) + 1))
+    return cpus
+
+
+def format_cpulist(cpus) -> str:
+    return ",".join(str(cpu) for cpu in sorted(cpus))
+
+
+def topology() -> Dict[int, List[int]]:
+    """The CPUs this process may use, by NUMA node. Hosts without NUMA information are a single node 0."""
+    available = set(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else set(range(os.cpu_count()))
+    nodes = {}
+    for path in NODES.glob("node[0-9]*"):
+        cpus = [cpu for cpu in parse_cpulist((path / "cpulist").read_text()) if cpu in available]
+        if cpus:
+            nodes[int(path.name[4:])] = cpus
+    return dict(sorted(nodes.items())) or {0: sorted(available)}
+
+
+def requested(cfg) -> bool:
+    return any(field in cfg["container"] for field in FIELDS)
+
+
+class Placement:
+    """
+    Assigns host cores to containers from the `cpus`, `cpuset`, `memory`, `numa_node` and `priority` fields of their
+    config's container section.
+
+    Latency priority containers get whole cores of their own, `ceil(cpus)` of them or the explicit `cpuset`, packed into
+    the NUMA node with the fewest free cores that still fits them, so large blocks of free cores stay available. Other
+    containers run on the shared cores, those nobody has dedicated, limited to `cpus` by CFS quota; when cores get
+    dedicated, running shared containers are moved off them, and they get them back at the next placement or
+    `rebalance`. A shared container is never left with fewer than `ceil(cpus)` cores. At least `shared` cores always
+    stay shared, for batch work and the orchestrator itself. A launch that does not fit raises `PlacementError`, or
+    waits for cores to free up for up to the config's `wait` seconds.
+
+    Dedicated cores are read back from the labels of active containers, so placements survive restarts; launches
+    being created are held as pending in the meantime. The older `cpu_quota` and `mem_limit` keys are read as `cpus`
+    and `memory`.
+    """
+
+    def __init__(self, client, nodes: Dict[int, List[int]] | None = None, shared: int = 1, poll: float = 0.5):
+        self.client = client
+        self.nodes = nodes if nodes is not None else topology()
+        self.cpus = [cpu for cpus in self.nodes.values() for cpu in cpus]
+        self.shared = shared
+        self.poll = poll
+        self.pending: Dict[str, Set[int]] = {}
+        self.applied: Dict[str, str] = {}  # the last cpuset set on each shared container, by container id
+        self.lock = threading.Lock()
+
+    def _active(self) -> list:
+        """Active containers with a placement, from one sparse listing."""
+        containers = self.client.containers.list(all=True, sparse=True, filters={"label": LABEL_PRIORITY})
+        return [container for container in containers if container.attrs["State"] in ACTIVE]
+
+    def dedicated(self, containers=None) -> Dict[str, Set[int]]:
+        """Dedicated cores of every active container and pending launch, by container name."""
+        containers = self._active() if containers is None else containers
+        allocations = {
+            container.attrs["Names"][0].lstrip("/"): set(parse_cpulist(container.attrs["Labels"][LABEL_CPUSET]))
+            for container in containers if LABEL_CPUSET in container.attrs["Labels"]
+        }
+        allocations.update(self.pending)
+        return allocations
+
+    def _moves(self, containers, taken: Set[int], strict: bool = True) -> Dict[str, str]:
+        """
+        The cpuset of each shared container once `taken` cores are dedicated. Raises `PlacementError` if one would be
+        left with fewer than `ceil(cpus)` cores, unless not `strict`, when it keeps what is left.
+        """
+        moves = {}
+        for container in containers:
+            labels = container.attrs["Labels"]
+            allowed = labels.get(LABEL_ALLOWED)
+            if allowed is None:
+                continue
+            cpus = set(parse_cpulist(allowed)) - taken
+            needed = math.ceil(float(labels.get(LABEL_CPUS, 0))) or 1
+            if strict and len(cpus) < needed:
+                name = container.attrs["Names"][0].lstrip("/")
+                raise PlacementError(f"Container {name} would have fewer than {needed} cores, its cpuset is {allowed}")
+            if cpus:
+                moves[container.id] = format_cpulist(cpus)
+        return moves
+
+    def _apply(self, moves: Dict[str, str]):
+        from docker.errors import DockerException
+
+        for container_id, cpuset in moves.items():
+            if self.applied.get(container_id) == cpuset:
+                continue
+            try:
+                self.client.api.update_container(container_id, cpuset_cpus=cpuset)
+                self.applied[container_id] = cpuset
+            except DockerException:
+                self.applied.pop(container_id, None)  # it stopped in the meantime
+        for container_id in set(self.applied) - set(moves):
+            del self.applied[container_id]
+
+    def rebalance(self):
+        """Give shared containers back the cores of dedicated containers that have stopped."""
+        with self.lock:
+            containers = self._active()
+            taken = set().union(*self.dedicated(containers).values())
+            self._apply(self._moves(containers, taken, strict=False))
+
+    def _request(self, cfg) -> dict:
+        container = cfg["container"]
+        priority = container.get("priority", "latency" if "cpuset" in container else "normal")
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority class {priority}, expected one of {', '.join(PRIORITIES)}")
+        cpus = container.get("cpus")
+        if cpus is None and "cpu_quota" in container:
+            cpus = container["cpu_quota"] / container.get("cpu_period", CPU_PERIOD)
+        if cpus is not None and cpus <= 0:
+            raise ValueError("cpus must be positive")
+        node = container.get("numa_node")
+        if node is not None and node not in self.nodes:
+            raise ValueError(f"NUMA node {node} is not available, nodes are {', '.join(map(str, self.nodes))}")
+        cpuset = container.get("cpuset")
+        if cpuset is not None:
+            cpuset = set(parse_cpulist(str(cpuset)))
+            if not cpuset <= set(self.cpus):
+                raise ValueError(
+                    f"cpuset {format_cpulist(cpuset)} is not within the host's {format_cpulist(self.cpus)}"
+                )
+        return {"priority": priority, "cpus": cpus, "cpuset": cpuset, "node": node,
+                "memory": container.get("memory", container.get("mem_limit")), "wait": container.get("wait", 0)}
+
+    def _pick(self, request: dict, taken: Set[int]) -> Set[int]:
+        free = [cpu for cpu in self.cpus if cpu not in taken]
+        if request["cpuset"] is not None:
+            wanted = request["cpuset"]
+        else:
+            count = math.ceil(request["cpus"] or 1)
+            nodes = [request["node"]] if request["node"] is not None else list(self.nodes)
+            fits = [
+                [cpu for cpu in self.nodes[node] if cpu not in taken] for node in nodes
+            ]
+            fits = [cpus for cpus in fits if len(cpus) >= count]
+            if not fits:
+                raise PlacementError(f"No NUMA node has {count} free cores, {len(free)} are free in total")
+            # best fit: the fullest node that still fits
+            wanted = set(min(fits, key=len)[:count])
+        if len(free) - len(wanted) < self.shared:
+            raise PlacementError(f"Dedicating {len(wanted)} cores would leave fewer than {self.shared} shared")
+        return wanted
+
+    def place(self, name: str, cfg) -> tuple[dict, dict]:
+        """
+        Resources of a container about to be created: its Docker run arguments and labels. Dedicated cores are held
+        as pending until `release` is called, once the container exists.
+        """
+        request = self._request(cfg)
+        deadline = time.monotonic() + request["wait"]
+        while True:
+            try:
+                return self._place(name, request)
+            except PlacementError:
+                if time.monotonic() + self.poll > deadline:
+                    raise
+            time.sleep(self.poll)
+
+    def _place(self, name: str, request: dict) -> tuple[dict, dict]:
+        priority = PRIORITIES[request["priority"]]
+        kwargs = {"cpu_shares": priority["cpu_shares"]}
+        labels = {LABEL_PRIORITY: request["priority"]}
+        if request["memory"] is not None:
+            kwargs["mem_limit"] = request["memory"]
+        if request["node"] is not None:
+            kwargs["cpuset_mems"] = str(request["node"])
+        if request["cpus"] is not None:
+            kwargs["nano_cpus"] = int(request["cpus"] * 1e9)
+
+        with self.lock:
+            containers = self._active()
+            allocations = self.dedicated(containers)
+            allocations.pop(name, None)
+            taken = set().union(*allocations.values())
+            if request["cpuset"] is not None and request["cpuset"] & taken:
+                conflict = format_cpulist(request["cpuset"] & taken)
+                raise PlacementError(f"cpuset {conflict} is dedicated to another container")
+            if priority["dedicated"]:
+                cpus = self._pick(request, taken)
+                moves = self._moves(containers, taken | cpus)
+                self.pending[name] = cpus
+                labels[LABEL_CPUSET] = format_cpulist(cpus)
+            else:
+                if request["cpuset"] is not None:
+                    allowed = request["cpuset"]
+                elif request["node"] is not None:
+                    allowed = set(self.nodes[request["node"]])
+                else:
+                    allowed = set(self.cpus)
+                cpus = allowed - taken
+                needed = math.ceil(request["cpus"] or 1)
+                if len(cpus) < needed:
+                    raise PlacementError(f"{len(cpus)} shared cores are free, {needed} are needed")
+                # shared cores freed since the last placement are given back on the way
+                moves = self._moves(containers, taken, strict=False)
+                labels[LABEL_ALLOWED] = format_cpulist(allowed)
+                if request["cpus"] is not None:
+                    labels[LABEL_CPUS] = str(request["cpus"])
+            self._apply(moves)
+        kwargs["cpuset_cpus"] = format_cpulist(cpus)
+        return kwargs, labels
+
+    def release(self, name: str):
+        with self.lock:
+            self.pending.pop(name, None)
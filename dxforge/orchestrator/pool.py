@@ -0,0 +1,189 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+RUNNER = Path(__file__).with_name("runner.py")
+LABEL_POOL = "dxforge.pool"
+LABEL_OWNER = "dxforge.pool_owner"
+NAME_PREFIX = "dxforge_pool_"
+OWNER = f"{socket.gethostname()}/{os.getpid()}"
+
+
+def _alive(owner: str | None) -> bool:
+    """Whether the process that owns a pool container may still be running."""
+    host, _, pid = (owner or "").rpartition("/")
+    if host != socket.gethostname():
+        # another host's process can't be checked, only containers without an owner are reaped
+        return owner is not None
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class WarmPool:
+    """
+    Idle containers of one image with the interpreter started and `preload` modules imported, waiting for a script.
+
+    Each container runs `runner.py` and listens on a Unix socket in `directory`, which is mounted into it; the socket
+    appears once the container is ready. `launch` sends a script's source over the socket, so it starts running
+    without creating a container or starting Python. Containers are single use, a replacement is started in the
+    background after each launch.
+
+    The script runs from its source alone: files next to it on the host are not mounted, unlike with `run.run`.
+    Idle containers are labelled with the process that started them; those of the image whose process has exited,
+    e.g. before a restart, are removed when the pool is created. A container whose socket has not appeared after
+    `start_timeout` seconds is taken to have died and is replaced.
+    """
+
+    def __init__(self,
+                 client,
+                 image: str,
+                 directory: str | os.PathLike,
+                 size: int = 2,
+                 preload: Sequence[str] = ("dxlib", "pandas"),
+                 labels: Dict[str, str] | None = None,
+                 timeout: float = 5.0,
+                 start_timeout: float = 60.0,
+                 ):
+        self.client = client
+        self.image = image
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # the container may run as another user, which must be able to create its socket here, but not list or
+        # remove the others'
+        os.chmod(self.directory, 0o1733)
+        self.size = size
+        self.preload = list(preload)
+        self.labels = {**(labels or {}), LABEL_POOL: image, LABEL_OWNER: OWNER}
+        self.timeout = timeout
+        self.start_timeout = start_timeout
+
+        self.idle: List[dict] = []  # {"id", "socket", "created"}, oldest first
+        self.lock = threading.Lock()
+        self._filling = threading.Lock()
+        self.reap()
+
+    def reap(self):
+        """Remove idle containers of this image left behind by a process that has exited, and their sockets."""
+        from docker.errors import DockerException
+
+        containers = self.client.containers.list(
+            all=True, sparse=True, filters={"label": f"{LABEL_POOL}={self.image}"}
+        )
+        for container in containers:
+            # launched containers keep the label, but are renamed after their script
+            name = container.attrs["Names"][0].lstrip("/")
+            if not name.startswith(NAME_PREFIX) or _alive(container.attrs["Labels"].get(LABEL_OWNER)):
+                continue
+            try:
+                self.client.api.remove_container(container.id, force=True)
+            except DockerException:
+                pass
+            socket_path = self._socket(name[len(NAME_PREFIX):])
+            socket_path.unlink(missing_ok=True)
+            socket_path.with_name(f"{socket_path.name}.tmp").unlink(missing_ok=True)
+
+    def _socket(self, token: str) -> Path:
+        return self.directory / f"{token}.sock"
+
+    def _create(self) -> dict:
+        token = uuid.uuid4().hex
+        container = self.client.containers.run(
+            image=self.image,
+            command=["python3", "/dxforge/runner.py", f"/dxforge/sockets/{token}.sock", *self.preload],
+            volumes={
+                str(RUNNER): {"bind": "/dxforge/runner.py", "mode": "ro"},
+                str(self.directory.resolve()): {"bind": "/dxforge/sockets", "mode": "rw"},
+            },
+            detach=True,
+            name=f"{NAME_PREFIX}{token}",
+            labels=self.labels,
+        )
+        return {"id": container.id, "socket": self._socket(token), "created": time.monotonic()}
+
+    def _expire(self) -> List[dict]:
+        """Discard idle containers whose socket has not appeared in time, they exited or their socket was removed."""
+        now = time.monotonic()
+        with self.lock:
+            expired = [
+                entry for entry in self.idle
+                if now - entry["created"] > self.start_timeout and not entry["socket"].exists()
+            ]
+            for entry in expired:
+                self.idle.remove(entry)
+        for entry in expired:
+            self._discard(entry)
+        return expired
+
+    def fill(self):
+        """Start containers until `size` are idle. Blocks while they are created, not until they are ready."""
+        with self._filling:
+            self._expire()
+            while len(self.idle) < self.size:
+                entry = self._create()
+                with self.lock:
+                    self.idle.append(entry)
+
+    def refill(self):
+        threading.Thread(target=self.fill, daemon=True).start()
+
+    def _discard(self, entry: dict):
+        from docker.errors import DockerException
+
+        try:
+            self.client.api.remove_container(entry["id"], force=True)
+        except DockerException:
+            pass
+        entry["socket"].unlink(missing_ok=True)
+
+    def launch(self, script_path: str, source: str | None = None, args: Sequence[str] = ()) -> str | None:
+        """
+        Run a script in a ready container, returning the container id, or None if no container is ready.
+        `source` defaults to the contents of `script_path`.
+        """
+        if source is None:
+            with open(script_path) as f:
+                source = f.read()
+        message = json.dumps({"filename": os.path.basename(script_path), "source": source, "args": list(args)})
+
+        if self._expire():
+            self.refill()
+        while True:
+            with self.lock:
+                ready = [entry for entry in self.idle if entry["socket"].exists()]
+                if not ready:
+                    return None
+                entry = ready[0]
+                self.idle.remove(entry)
+            try:
+                self._send(entry["socket"], message.encode())
+                return entry["id"]
+            except OSError:
+                # the container died or was removed while idle
+                self._discard(entry)
+            finally:
+                self.refill()
+
+    def _send(self, path: Path, message: bytes):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(str(path))
+            sock.sendall(message)
+            sock.shutdown(socket.SHUT_WR)
+            if sock.recv(2) != b"ok":
+                raise ConnectionError(f"Runner at {path} did not acknowledge the script")
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for entry in idle:
+            self._discard(entry)
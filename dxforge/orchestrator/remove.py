@@ -1,19 +1,24 @@
 import sys
 
-from docker import from_env
-from docker.errors import DockerException
 
+def remove(client, name, cache=None, archiver=None):
+    from docker.errors import DockerException
 
-def remove(client, name):
+    if cache is not None and cache.known(name) is False:
+        return False
     try:
-        container = client.containers.get(name)
-        container.remove(force=True)
+        if archiver is not None:
+            # the container's logs go with it
+            archiver.drain(name)
+        client.api.remove_container(name, force=True)
         return True
     except DockerException as e:
         return False
 
 
 if __name__ == "__main__":
+    from docker import from_env
+
     print(
         remove(from_env(), sys.argv[1])
     )
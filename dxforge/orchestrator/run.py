@@ -1,14 +1,62 @@
 import os
+import threading
+import time
 import yaml
-import docker
 import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import List
 
-from docker.errors import NotFound
+from .build import build, forget
+from .placement import requested
+from .state import StateStore
 
-client = docker.from_env()
 STATE_DIR = Path("./.state")
-STATE_DIR.mkdir(exist_ok=True)
+
+# labels set on every container started by dxforge, so the fleet can be listed in one query
+LABEL_MANAGED = "dxforge.managed"
+LABEL_SCRIPT = "dxforge.script"
+LABEL_SCRIPT_HASH = "dxforge.script_hash"
+
+_client = None
+_client_lock = threading.Lock()
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_client():
+    """The Docker client, connected on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            # the Docker SDK pulls in requests and urllib3, only import it when a client is needed
+            import docker
+            _client = docker.from_env()
+        return _client
+
+
+def get_state_dir():
+    STATE_DIR.mkdir(exist_ok=True)
+    return STATE_DIR
+
+
+def get_state_store() -> StateStore:
+    """The container state store, opened on first use."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = StateStore(get_state_dir() / "state.sqlite")
+            _migrate_state_files(_store)
+        return _store
+
+
+def _migrate_state_files(store: StateStore):
+    # state used to be one `<script hash>.running` file per script, holding the container id
+    for state_file in get_state_dir().glob("*.running"):
+        script_hash = state_file.stem
+        if store.get(script_hash) is None:
+            store.put(script_hash, "", state_file.read_text().strip(), f"runner_{script_hash[:12]}")
+        state_file.unlink()
 
 
 def load_config(path="run_config.yaml"):
@@ -20,62 +68,188 @@ def hash_script_path(script_path):
     return hashlib.sha256(script_path.encode()).hexdigest()
 
 
-def get_state_path(script_path):
-    h = hash_script_path(script_path)
-    return STATE_DIR / f"{h}.running"
-
-
 def is_running(script_path):
-    state_file = get_state_path(script_path)
-    if not state_file.exists():
+    from docker.errors import NotFound
+
+    script_hash = hash_script_path(script_path)
+    state = get_state_store().get(script_hash)
+    if state is None:
         return False
     try:
-        container = client.containers.get(state_file.read_text().strip())
+        container = get_client().containers.get(state["container_id"])
         return container.status in ("running", "created")
     except NotFound:
-        state_file.unlink(missing_ok=True)
+        get_state_store().remove(script_hash)
         return False
 
 
-def write_log(container, log_path):
-    with open(log_path, "ab") as f:
-        for log in container.logs(stream=True, stdout=True, stderr=True):
-            f.write(log)
-
-
-def run(cfg):
+def fleet_status(cache=None) -> List[dict]:
+    """
+    Status of every container started by dxforge, from a single labelled container listing reconciled with the
+    state store: stored containers that are gone are dropped, labelled ones the store lost track of are added back.
+    With an in-sync `ContainerCache`, the listing comes from the cache instead of the daemon.
+    """
+    store = get_state_store()
+    if cache is not None and cache.ready:
+        containers = cache.list({LABEL_MANAGED: "true"})
+    else:
+        # sparse listings skip a per-container inspect, their attributes are those of the list endpoint
+        containers = [
+            {"id": container.id, "name": container.attrs["Names"][0].lstrip("/"),
+             "status": container.attrs["State"], "labels": container.attrs["Labels"]}
+            for container in get_client().containers.list(
+                all=True, sparse=True, filters={"label": f"{LABEL_MANAGED}=true"}
+            )
+        ]
+    states = {state["script_hash"]: state for state in store.all()}
+    scripts = {state["container_id"]: script_hash for script_hash, state in states.items()}
+    listed = {}
+    for container in containers:
+        # warm pool containers only get their script once launched, and their labels cannot change then
+        script_hash = container["labels"].get(LABEL_SCRIPT_HASH) or scripts.get(container["id"])
+        if script_hash is not None:
+            listed[script_hash] = container
+
+    for script_hash, container in listed.items():
+        state = states.get(script_hash)
+        if state is None or state["container_id"] != container["id"]:
+            store.put(script_hash, container["labels"].get(LABEL_SCRIPT, ""), container["id"], container["name"])
+    gone = [script_hash for script_hash in states if script_hash not in listed]
+    if gone:
+        store.remove(*gone)
+    store.set_statuses({script_hash: container["status"] for script_hash, container in listed.items()})
+    return store.all()
+
+
+def inspect(name, cache=None):
+    """Id and status of a container, from an in-sync `ContainerCache` if given. Raises NotFound."""
+    from docker.errors import NotFound
+
+    if cache is not None and cache.ready:
+        state = cache.get(name)
+        if state is None:
+            raise NotFound(f"No such container: {name}")
+        return state["id"], state["status"]
+    container = get_client().containers.get(name)
+    return container.id, container.status
+
+
+def run(cfg, cache=None, pool=None, archiver=None, placement=None):
+    """
+    Start the container of a config's script, unless it is already running. With a `WarmPool` for the config's image,
+    the script is handed to one of its idle containers when one is ready, replacing the script's previous container,
+    whose logs are drained into the `LogArchiver` first if one is given. With a `Placement`, configs with resource
+    fields get cores and limits assigned at every launch, so they always run in a new container.
+    """
+    from docker.errors import APIError, NotFound
+
+    client = get_client()
     script_path = cfg["container"]["script"]
-    container_name = f"runner_{hash_script_path(script_path)[:12]}"
-    state_file = get_state_path(script_path)
+    script_hash = hash_script_path(script_path)
+    container_name = f"runner_{script_hash[:12]}"
+    store = get_state_store()
 
     try:
-        container = client.containers.get(container_name)
-        if container.status == 'running':
-            print(f"Script '{script_path}' is already running (container: {container.id}).")
-            return container_name
-        else:
-            print(f"Starting existing container {container_name}...")
-            container.start()
-            state_file.write_text(container.id)
+        container_id, status = inspect(container_name, cache)
+    except NotFound:
+        container_id, status = None, None
+
+    if status == 'running':
+        print(f"Script '{script_path}' is already running (container: {container_id}).")
+        store.put(script_hash, script_path, container_id, container_name, "running")
+        return container_name
+
+    placed = placement is not None and requested(cfg)
+
+    # warm containers are created without resources
+    if pool is not None and not placed:
+        launched = pool.launch(script_path)
+        if launched is not None:
+            # the script is already running, what is left is bookkeeping
+            if container_id is not None:
+                if archiver is not None:
+                    archiver.drain(container_name)
+                client.api.remove_container(container_id, force=True)
+            client.api.rename(launched, container_name)
+            store.put(script_hash, script_path, launched, container_name, "running")
+            print(f"Started script {script_path} in warm container {container_name}")
             return container_name
-    except docker.errors.NotFound:
+        print(f"No warm container of {pool.image} is ready, starting {container_name} cold")
+
+    if container_id is not None and placed:
+        # a stopped container keeps the cores it was created with, which may since have been given to another
+        if archiver is not None:
+            archiver.drain(container_name)
+        client.api.remove_container(container_id, force=True)
+        container_id = None
+
+    if container_id is not None:
+        print(f"Starting existing container {container_name}...")
+        client.api.start(container_id)
+        store.put(script_hash, script_path, container_id, container_name, "running")
+        return container_name
+    else:
         script_dir = os.path.dirname(script_path)
         script_name = os.path.basename(script_path)
+        resources, labels = placement.place(container_name, cfg) if placed else ({}, {})
 
-        container = client.containers.run(
-            image=cfg["container"]["image"],
+        kwargs = dict(
             command=["python3", f"/app/{script_name}"],
             volumes={
                 script_dir: {"bind": "/app", "mode": "ro"}
             },
             detach=True,
             name=container_name,
+            labels={LABEL_MANAGED: "true", LABEL_SCRIPT: script_path, LABEL_SCRIPT_HASH: script_hash, **labels},
+            **resources,
         )
+        try:
+            image = build(client, cfg)
+            try:
+                container = client.containers.run(image=image, **kwargs)
+            except APIError as e:
+                # the image was removed since it was built, and Docker failed to pull it
+                if e.status_code == 409 or not forget(client, image):
+                    raise
+                container = client.containers.run(image=build(client, cfg), **kwargs)
+        except APIError as e:
+            if e.status_code != 409:
+                raise
+            # a concurrent launch of the same script created it first
+            print(f"Script '{script_path}' was started concurrently (container: {container_name}).")
+            return container_name
+        finally:
+            if placed:
+                # the container's labels hold its cores from now on
+                placement.release(container_name)
 
-        state_file.write_text(container.id)
+        store.put(script_hash, script_path, container.id, container_name, "running")
         print(f"Started new container {container_name} for script {script_path}")
         return container_name
 
+def run_batch(paths: List[str], max_workers: int = 8, cache=None, placement=None, launch=None) -> List[dict]:
+    """
+    Launch the containers of many config files concurrently, at most `max_workers` at a time.
+    Returns one result per config, in order, with the container name or the error and the time it took.
+    `launch` starts the container of one config file and returns its name, `run` with `cache` and `placement` if
+    not given.
+    """
+    if launch is None:
+        launch = lambda path: run(load_config(path), cache, placement=placement)
+
+    def timed(path):
+        start = time.perf_counter()
+        try:
+            name = launch(path)
+            return {"config": path, "container": name, "error": None, "seconds": time.perf_counter() - start}
+        except Exception as e:
+            return {"config": path, "container": None, "error": f"{type(e).__name__}: {e}",
+                    "seconds": time.perf_counter() - start}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(timed, paths))
+
+
 if __name__ == "__main__":
     config = load_config("examples/wick/config.yaml")
     run(config)
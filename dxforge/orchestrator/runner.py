@@ -0,0 +1,58 @@
+"""
+Entry point of warm pool containers, see `pool.WarmPool`.
+
+Imports the modules named on the command line, then listens on a Unix socket for a single script, acknowledges it
+and runs it as `__main__`. Only the standard library is used, since the image may not have dxforge installed.
+
+    python3 runner.py SOCKET [MODULE ...]
+"""
+import importlib
+import json
+import os
+import socket
+import sys
+
+
+def preload(modules):
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            print(f"[runner] could not preload {module}", file=sys.stderr)
+
+
+def receive(path) -> dict:
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(f"{path}.tmp")
+    # the socket directory is sticky and writable by all but not listable, so any container user can bind in it;
+    # the socket itself must be connectable by the orchestrator's user
+    os.chmod(f"{path}.tmp", 0o666)
+    server.listen(1)
+    # only appears once listening, so the orchestrator can take the socket's existence as readiness
+    os.rename(f"{path}.tmp", path)
+    try:
+        connection, _ = server.accept()
+        with connection:
+            chunks = []
+            while chunk := connection.recv(65536):
+                chunks.append(chunk)
+            message = json.loads(b"".join(chunks))
+            connection.sendall(b"ok")
+    finally:
+        server.close()
+        os.unlink(path)
+    return message
+
+
+def main():
+    path, modules = sys.argv[1], sys.argv[2:]
+    preload(modules)
+    message = receive(path)
+
+    sys.argv = [message["filename"]] + message.get("args", [])
+    code = compile(message["source"], message["filename"], "exec")
+    exec(code, {"__name__": "__main__", "__file__": message["filename"], "__builtins__": __builtins__})
+
+
+if __name__ == "__main__":
+    main()
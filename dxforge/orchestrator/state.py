@@ -0,0 +1,73 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS containers (
+    script_hash TEXT PRIMARY KEY,
+    script TEXT NOT NULL,
+    container_id TEXT NOT NULL,
+    container_name TEXT NOT NULL,
+    status TEXT,
+    updated REAL NOT NULL
+)
+"""
+COLUMNS = ("script_hash", "script", "container_id", "container_name", "status", "updated")
+
+
+class StateStore:
+    """
+    The container launched for each script, keyed by the hash of the script path, in a SQLite database.
+
+    The database runs in WAL mode so status reads do not wait on writes, and each thread gets its own connection,
+    so concurrent launches can share a store.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = str(path)
+        self._local = threading.local()
+        self._connection().execute(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, script_hash: str) -> dict | None:
+        row = self._connection().execute(
+            f"SELECT {', '.join(COLUMNS)} FROM containers WHERE script_hash = ?", (script_hash,)
+        ).fetchone()
+        return dict(zip(COLUMNS, row)) if row else None
+
+    def all(self) -> List[dict]:
+        rows = self._connection().execute(f"SELECT {', '.join(COLUMNS)} FROM containers ORDER BY script")
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def put(self, script_hash: str, script: str, container_id: str, container_name: str, status: str | None = None):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO containers VALUES (?, ?, ?, ?, ?, ?)",
+            (script_hash, script, container_id, container_name, status, time.time()),
+        )
+
+    def set_statuses(self, statuses: Dict[str, str]):
+        """Record the status of many scripts' containers in one transaction."""
+        connection = self._connection()
+        now = time.time()
+        with connection:
+            connection.execute("BEGIN")
+            connection.executemany(
+                "UPDATE containers SET status = ?, updated = ? WHERE script_hash = ?",
+                [(status, now, script_hash) for script_hash, status in statuses.items()],
+            )
+
+    def remove(self, *script_hashes: str):
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN")
+            connection.executemany("DELETE FROM containers WHERE script_hash = ?", [(h,) for h in script_hashes])
@@ -1,19 +1,21 @@
 import sys
 
-from docker import from_env
-from docker.errors import DockerException
 
+def stop(client, name, cache=None):
+    from docker.errors import DockerException
 
-def stop(client, name):
+    if cache is not None and cache.known(name) is False:
+        return False
     try:
-        container = client.containers.get(name)
-        container.stop()
+        client.api.stop(name)
         return True
     except DockerException as e:
         return False
 
 
 if __name__ == "__main__":
+    from docker import from_env
+
     print(
         stop(from_env(), sys.argv[1])
     )
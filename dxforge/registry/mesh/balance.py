@@ -0,0 +1,65 @@
+import random
+from typing import Dict, List, Tuple
+
+Key = Tuple[str, str]
+
+
+class Balancer:
+    """Picks which instances of a service a caller should use."""
+
+    POLICIES = ("round_robin", "weighted", "p2c")
+
+    def __init__(self, rng: random.Random | None = None):
+        self.rng = rng or random.Random()
+        self.loads: Dict[Key, float] = {}  # last load reported by each instance
+        self._next: Dict[str, int] = {}  # service name -> round robin position
+        self._credit: Dict[Key, float] = {}  # smooth weighted round robin state
+
+    def report(self, key: Key, load: float):
+        self.loads[key] = load
+
+    def forget(self, key: Key):
+        self.loads.pop(key, None)
+        self._credit.pop(key, None)
+
+    def select(self, name: str, instances: List, policy: str, count: int = 1) -> List:
+        """Up to `count` instances, best first."""
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown balancing policy '{policy}', expected one of {', '.join(self.POLICIES)}")
+        if count < 1:
+            raise ValueError("count must be positive")
+        if not instances:
+            return []
+        count = min(count, len(instances))
+        return getattr(self, f"_{policy}")(name, instances, count)
+
+    def _round_robin(self, name: str, instances: List, count: int) -> List:
+        start = self._next.get(name, 0) % len(instances)
+        self._next[name] = start + 1
+        return (instances[start:] + instances[:start])[:count]
+
+    def _weighted(self, name: str, instances: List, count: int) -> List:
+        # smooth weighted round robin: every instance earns its weight in credit, the richest pays the total back
+        total = 0
+        best = None
+        for instance in instances:
+            key = (instance.name, instance.service_id)
+            self._credit[key] = self._credit.get(key, 0) + instance.weight
+            total += instance.weight
+            if best is None or self._credit[key] > self._credit[(best.name, best.service_id)]:
+                best = instance
+        self._credit[(best.name, best.service_id)] -= total
+        rest = sorted((instance for instance in instances if instance is not best), key=lambda i: -i.weight)
+        return [best] + rest[:count - 1]
+
+    def _p2c(self, name: str, instances: List, count: int) -> List:
+        # power of two choices: the less loaded of two random instances, then the rest by reported load
+        def load(instance):
+            return self.loads.get((instance.name, instance.service_id), 0.0)
+
+        candidates = self.rng.sample(instances, 2) if len(instances) > 1 else instances
+        best = min(candidates, key=load)
+        if count == 1:
+            return [best]
+        rest = sorted((instance for instance in instances if instance is not best), key=load)
+        return [best] + rest[:count - 1]
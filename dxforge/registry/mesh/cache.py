@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Iterable
+
+MISSING = object()
+
+
+class DiscoveryCache:
+    """LRU cache of registry lookups with a per-entry TTL."""
+
+    def __init__(self, ttl: float = 30.0, maxsize: int = 1024, clock=time.monotonic):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.clock = clock
+        self.entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.lock = threading.Lock()
+        # bumped on every invalidation, so that lookups racing with one do not re-insert stale results
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            expires, value = entry
+            if expires <= self.clock():
+                del self.entries[key]
+                self.stale += 1
+                self.misses += 1
+                return MISSING
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any, generation: int | None = None, ttl: float | None = None):
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.entries[key] = (self.clock() + (self.ttl if ttl is None else ttl), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, keys: Iterable[Hashable]):
+        with self.lock:
+            self.generation += 1
+            for key in keys:
+                if self.entries.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
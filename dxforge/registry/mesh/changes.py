@@ -0,0 +1,81 @@
+import asyncio
+import threading
+from collections import deque
+from itertools import islice
+from typing import List
+
+
+class ChangeLog:
+    """Bounded, revisioned history of registry mutations that readers can block on."""
+
+    def __init__(self, maxlen: int = 10000):
+        self.revision = 0
+        self.history = deque(maxlen=maxlen)
+        self.condition = threading.Condition()
+        self.waiters = {}  # future -> its event loop, for `await_change`
+
+    def append(self, op: str, **payload) -> dict:
+        with self.condition:
+            self.revision += 1
+            change = {"revision": self.revision, "op": op, **payload}
+            self.history.append(change)
+            self.condition.notify_all()
+            self._wake()
+            return change
+
+    def reset(self, revision: int):
+        """Continue numbering from `revision`, forgetting the history before it."""
+        with self.condition:
+            self.revision = revision
+            self.history.clear()
+            self.condition.notify_all()
+            self._wake()
+
+    def _wake(self):
+        waiters, self.waiters = self.waiters, {}
+        for future, loop in waiters.items():
+            if loop.is_closed():
+                continue
+            try:
+                loop.call_soon_threadsafe(_resolve, future)
+            except RuntimeError:
+                pass  # the loop closed in the meantime, nobody is waiting on it anymore
+
+    def since(self, revision: int) -> List[dict] | None:
+        """Changes after `revision`, or None if some of them are no longer retained."""
+        with self.condition:
+            if revision >= self.revision:
+                return []
+            if not self.history or revision + 1 < self.history[0]["revision"]:
+                return None
+            return list(islice(self.history, revision + 1 - self.history[0]["revision"], None))
+
+    def wait(self, revision: int, timeout: float) -> List[dict] | None:
+        """Like `since`, but blocks up to `timeout` seconds for a change after `revision`."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.revision > revision, timeout)
+            return self.since(revision)
+
+    async def await_change(self, revision: int, timeout: float) -> List[dict] | None:
+        """
+        Like `wait`, for event loops: waiting does not hold a thread, so any number of long-polls can be pending.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.condition:
+            if self.revision > revision:
+                return self.since(revision)
+            self.waiters[future] = loop
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self.condition:
+                self.waiters.pop(future, None)
+        return self.since(revision)
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
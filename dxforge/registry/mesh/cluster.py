@@ -0,0 +1,142 @@
+import threading
+from typing import List
+
+import httpx
+
+from . import encoding
+from .mesh_service import MeshService
+
+
+class Cluster:
+    """
+    Leader/follower replication of a `MeshService` over a fixed list of peer URLs.
+
+    The leader accepts writes; followers long-poll its `sync` endpoint, apply its changes in order and serve reads. When
+    a follower loses its leader, the reachable node with the highest revision (ties going to the earliest in `peers`)
+    promotes itself, and the others follow it. A node only counts a peer out once it has missed `failure_threshold`
+    probes in a row, so nodes started together do not each promote themselves before the others are up; two leaders that
+    still meet keep the one ranked first by the same order. This is not a consensus protocol: writes the old leader
+    acknowledged but had not yet replicated are lost on failover.
+    """
+
+    def __init__(self,
+                 mesh: MeshService,
+                 url: str,
+                 peers: List[str],
+                 poll_timeout: float = 5.0,
+                 probe_interval: float = 1.0,
+                 failure_threshold: int = 3,
+                 ):
+        if url not in peers:
+            peers = [url] + list(peers)
+        self.mesh = mesh
+        self.url = url
+        self.peers = peers
+        self.poll_timeout = poll_timeout
+        self.probe_interval = probe_interval
+        self.failure_threshold = failure_threshold
+
+        self.leader: str | None = None
+        self.order = {peer: i for i, peer in enumerate(peers)}
+        self.misses = {peer: 0 for peer in peers if peer != url}  # consecutive failed probes of each peer
+        self.client = httpx.Client(timeout=httpx.Timeout(probe_interval, read=poll_timeout + probe_interval))
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+        mesh.cluster = self
+        mesh.demote()
+
+    @property
+    def role(self) -> str:
+        return "leader" if self.leader == self.url else "follower"
+
+    def status(self) -> dict:
+        return {"url": self.url, "role": self.role, "leader": self.leader, "revision": self.mesh.changes.revision}
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def statuses(self) -> List[dict]:
+        """Status of every reachable node, this one included."""
+        statuses = []
+        for peer in self.peers:
+            if peer == self.url:
+                statuses.append(self.status())
+                continue
+            try:
+                response = self.client.get(f"{peer}/cluster/status", timeout=self.probe_interval)
+                response.raise_for_status()
+                statuses.append(response.json())
+                self.misses[peer] = 0
+            except httpx.HTTPError:
+                self.misses[peer] += 1
+        return statuses
+
+    def rank(self, status: dict) -> tuple:
+        """Election order of a node: highest revision first, then earliest in `peers`."""
+        return status["revision"], -self.order.get(status["url"], len(self.order))
+
+    def elect(self):
+        """Follow the current leader if there is one, otherwise promote the best placed node if it is this one."""
+        statuses = self.statuses()
+        leaders = [status for status in statuses if status["role"] == "leader" and status["url"] != self.url]
+        if leaders:
+            self._follow(max(leaders, key=self.rank)["url"])
+            return
+
+        reachable = {status["url"] for status in statuses}
+        if any(peer not in reachable and misses < self.failure_threshold for peer, misses in self.misses.items()):
+            # a peer that is not up yet may be better placed, wait until it is counted out
+            return
+        candidate = max(statuses, key=self.rank)
+        if candidate["url"] == self.url:
+            self.leader = self.url
+            self.mesh.promote()
+
+    def _follow(self, leader: str):
+        if self.leader == self.url:
+            self.mesh.demote()
+        self.leader = leader
+
+    def _replicate(self):
+        response = self.client.get(
+            f"{self.leader}/sync", params={"since": self.mesh.changes.revision, "timeout": self.poll_timeout},
+            headers={"accept": encoding.ACCEPT},
+        )
+        response.raise_for_status()
+        self.mesh.apply_sync(encoding.decode(response))
+
+    def _run(self):
+        failures = 0
+        while not self._stop.is_set():
+            if self.leader is None:
+                self.elect()
+                if self.leader is None:
+                    self._stop.wait(self.probe_interval)
+            elif self.leader == self.url:
+                # step down if another leader ranks first, e.g. after a partition or a simultaneous start
+                self._stop.wait(self.probe_interval)
+                better = [status for status in self.statuses() if status["role"] == "leader"
+                          and status["url"] != self.url and self.rank(status) > self.rank(self.status())]
+                if better:
+                    self._follow(max(better, key=self.rank)["url"])
+            else:
+                try:
+                    self._replicate()
+                    failures = 0
+                except httpx.HTTPError:
+                    failures += 1
+                    if failures >= self.failure_threshold:
+                        failures = 0
+                        # the leader has already been counted out by the failed polls
+                        self.misses[self.leader] = self.failure_threshold
+                        self.leader = None
+                    else:
+                        self._stop.wait(self.probe_interval)
@@ -0,0 +1,63 @@
+import dataclasses
+import json
+
+import httpx
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+# what clients ask for: msgpack when it is installed here, registries without it answer in JSON
+ACCEPT = f"{MSGPACK}, {JSON};q=0.9" if msgpack is not None else JSON
+# registry revision a snapshot reader's answer reflects
+REVISION = "x-dxforge-revision"
+
+
+def _default(obj):
+    if hasattr(obj, "to_dict"):
+        return obj.to_dict()
+    if dataclasses.is_dataclass(obj):
+        return dataclasses.asdict(obj)
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_default)
+    return json.dumps(content, default=_default, separators=(",", ":")).encode()
+
+
+def respond(content, request: Request | None = None, revision: int | None = None):
+    """
+    Encode an endpoint's result directly, in msgpack if the request accepts it and JSON otherwise, skipping the
+    framework's generic encoder. Without a request, e.g. when called in-process, the content is returned unchanged.
+    A `revision` is sent in the `REVISION` header.
+    """
+    if request is None:
+        return content
+    headers = {REVISION: str(revision)} if revision is not None else None
+    if msgpack is not None and MSGPACK in request.headers.get("accept", ""):
+        return Response(msgpack.packb(content, default=_default), media_type=MSGPACK, headers=headers)
+    return Response(dumps(content), media_type=JSON, headers=headers)
+
+
+def decode(response: httpx.Response):
+    """Body of a registry response, in whichever format it was sent."""
+    content_type = response.headers.get("content-type", "")
+    if content_type.startswith(MSGPACK):
+        return msgpack.unpackb(response.content)
+    if orjson is not None and content_type.startswith(JSON):
+        return orjson.loads(response.content)
+    return response.json()
@@ -0,0 +1,163 @@
+import asyncio
+import heapq
+import random
+import threading
+import time
+from typing import Dict, List, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+from .mesh_service import MeshService, ServiceModel
+
+Key = Tuple[str, str]
+
+
+class HealthChecker:
+    """
+    Probes the endpoints of registered instances that ask for it (`ServiceModel.check`) and marks those failing
+    `failure_threshold` probes in a row unhealthy, until one succeeds again.
+
+    Probes run on a dedicated event loop thread, at most `concurrency` at a time, every `check_interval` seconds per
+    instance (`interval` by default), spread by +-`jitter` of the interval so instances registered together are not
+    probed in lockstep. New and removed instances are picked up from the registry's change log. Only a writable
+    registry probes; replicas receive the health changes of their leader.
+    """
+
+    def __init__(self,
+                 mesh: MeshService,
+                 interval: float = 10.0,
+                 timeout: float = 2.0,
+                 concurrency: int = 256,
+                 jitter: float = 0.1,
+                 failure_threshold: int = 2,
+                 rng: random.Random | None = None,
+                 ):
+        self.mesh = mesh
+        self.interval = interval
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.jitter = jitter
+        self.failure_threshold = failure_threshold
+        self.rng = rng or random.Random()
+
+        self.targets: Dict[Key, ServiceModel] = {}
+        self.due: Dict[Key, float] = {}  # key -> time of its next probe, entries in `queue` that differ are stale
+        self.queue: List[Tuple[float, Key]] = []
+        self.failures: Dict[Key, int] = {}
+        self.revision = -1
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=asyncio.run, args=(self._run(),), daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def _schedule(self, service: ServiceModel, delay: float):
+        key = (service.name, service.service_id)
+        self.targets[key] = service
+        self.due[key] = time.monotonic() + delay
+        heapq.heappush(self.queue, (self.due[key], key))
+
+    def _forget(self, key: Key):
+        self.targets.pop(key, None)
+        self.due.pop(key, None)
+        self.failures.pop(key, None)
+
+    def _period(self, service: ServiceModel) -> float:
+        interval = service.check_interval or self.interval
+        return interval * (1 + self.rng.uniform(-self.jitter, self.jitter))
+
+    def _track(self, service: ServiceModel):
+        key = (service.name, service.service_id)
+        self._forget(key)
+        if service.check is not None:
+            # a random first probe spreads the instances of a large registration over a whole interval
+            self._schedule(service, self.rng.uniform(0, service.check_interval or self.interval))
+
+    def _refresh(self):
+        """Catch up with the instances registered and removed since the last call."""
+        changes = self.mesh.changes.since(self.revision) if 0 <= self.revision <= self.mesh.changes.revision else None
+        if changes is None:
+            with self.mesh.lock:
+                services = list(self.mesh.service_index.values())
+                self.revision = self.mesh.changes.revision
+            for key in list(self.targets):
+                self._forget(key)
+            self.queue = []
+            for service in services:
+                self._track(service)
+            return
+
+        for change in changes:
+            if change["op"] == "register":
+                for service in change["services"]:
+                    self._track(ServiceModel(**service))
+            elif change["op"] == "deregister":
+                for service in change["services"]:
+                    self._forget((service["name"], service["service_id"]))
+        if changes:
+            self.revision = changes[-1]["revision"]
+
+    async def probe(self, client: httpx.AsyncClient, service: ServiceModel) -> bool:
+        """Whether an instance answers: a non-error response to GET {endpoints}/health, or an accepted connection."""
+        try:
+            if service.check == "http":
+                response = await client.get(f"{service.endpoints.rstrip('/')}/health")
+                return response.status_code < 400
+            if service.check == "tcp":
+                url = urlsplit(service.endpoints if "//" in service.endpoints else f"//{service.endpoints}")
+                port = url.port or (443 if url.scheme == "https" else 80)
+                _, writer = await asyncio.wait_for(asyncio.open_connection(url.hostname, port), self.timeout)
+                writer.close()
+                return True
+        except (httpx.HTTPError, OSError, asyncio.TimeoutError, ValueError):
+            return False
+        return False
+
+    async def _check(self, client: httpx.AsyncClient, semaphore: asyncio.Semaphore, service: ServiceModel):
+        key = (service.name, service.service_id)
+        async with semaphore:
+            healthy = await self.probe(client, service)
+        if self.targets.get(key) is not service:
+            return  # deregistered or replaced while probing
+
+        failures = 0 if healthy else self.failures.get(key, 0) + 1
+        self.failures[key] = failures
+        if (healthy and key in self.mesh.unhealthy) or failures == self.failure_threshold:
+            # off the loop, the registry lock may be held by a large registration
+            await asyncio.to_thread(self.mesh.set_health, [key], healthy)
+            if self.targets.get(key) is not service:
+                return
+        self._schedule(service, self._period(service))
+
+    async def _run(self):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=0)
+        async with httpx.AsyncClient(timeout=self.timeout, limits=limits) as client:
+            tasks = set()
+            while not self._stop.is_set():
+                if self.mesh.replica:
+                    self.revision = -1
+                    await asyncio.sleep(1.0)
+                    continue
+                self._refresh()
+
+                now = time.monotonic()
+                while self.queue and self.queue[0][0] <= now:
+                    due, key = heapq.heappop(self.queue)
+                    if self.due.get(key) != due:
+                        continue
+                    del self.due[key]
+                    task = asyncio.create_task(self._check(client, semaphore, self.targets[key]))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+
+                delay = self.queue[0][0] - now if self.queue else 1.0
+                await asyncio.sleep(min(max(delay, 0.01), 1.0))
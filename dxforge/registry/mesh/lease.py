@@ -0,0 +1,86 @@
+import math
+from typing import Dict, Hashable, List, Set, Tuple
+
+
+class TimingWheel:
+    """
+    Hierarchical timing wheel keeping one deadline per key.
+
+    Scheduling and cancelling are O(1). Each tick only touches the keys expiring in it, plus the keys of a single
+    coarser slot being cascaded down whenever a finer wheel wraps around, so the cost of `advance` does not depend on
+    how many keys are pending.
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 64, levels: int = 4, start: float = 0.0):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.current = math.floor(start / tick)
+        self.wheels: List[List[Set[Hashable]]] = [[set() for _ in range(slots)] for _ in range(levels)]
+        self.deadlines: Dict[Hashable, int] = {}
+        self.location: Dict[Hashable, Tuple[int, int]] = {}
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def __contains__(self, key: Hashable):
+        return key in self.deadlines
+
+    def schedule(self, key: Hashable, deadline: float):
+        """(Re)schedule `key` to expire at `deadline`, in the same clock as `advance`."""
+        self.cancel(key)
+        tick = max(math.ceil(deadline / self.tick), self.current + 1)
+        self.deadlines[key] = tick
+        self._place(key, tick)
+
+    def cancel(self, key: Hashable):
+        location = self.location.pop(key, None)
+        if location is not None:
+            level, index = location
+            self.wheels[level][index].discard(key)
+            del self.deadlines[key]
+
+    def advance(self, now: float) -> List[Hashable]:
+        """Move the wheel up to `now` and return the keys whose deadline has passed."""
+        expired = []
+        target = math.floor(now / self.tick)
+        while self.current < target:
+            self.current += 1
+            self._cascade()
+            slot = self.wheels[0][self.current % self.slots]
+            for key in slot:
+                del self.location[key]
+                del self.deadlines[key]
+            expired.extend(slot)
+            slot.clear()
+        return expired
+
+    def _place(self, key: Hashable, tick: int):
+        # keys beyond the top wheel's range are parked in its farthest slot and re-placed when it cascades
+        horizon = self.slots ** self.levels
+        tick = min(tick, self.current + horizon - 1)
+        delta = tick - self.current
+        level, span = 0, self.slots
+        while delta >= span:
+            level += 1
+            span *= self.slots
+        index = (tick // self.slots ** level) % self.slots
+        self.wheels[level][index].add(key)
+        self.location[key] = (level, index)
+
+    def _cascade(self):
+        # find the coarsest wheel whose slot boundary falls on the current tick, then redistribute top-down
+        level = 0
+        granularity = self.slots
+        while level + 1 < self.levels and self.current % granularity == 0:
+            level += 1
+            granularity *= self.slots
+        for level in range(level, 0, -1):
+            index = (self.current // self.slots ** level) % self.slots
+            slot = self.wheels[level][index]
+            if not slot:
+                continue
+            keys = list(slot)
+            slot.clear()
+            for key in keys:
+                self._place(key, self.deadlines[key])
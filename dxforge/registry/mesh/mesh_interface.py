@@ -1,34 +1,416 @@
-from typing import Any
+import os
+import threading
+from typing import Any, List
 
 import httpx
 
 from dxlib.interfaces import Server
-from .mesh_service import ServiceModel
+from . import encoding
+from .cache import DiscoveryCache, MISSING
+from .mesh_service import MeshService, ServiceModel
 
 
 class MeshInterface:
-    def __init__(self):
+    def __init__(self,
+                 pooled: bool = False,
+                 max_connections: int = 100,
+                 max_keepalive_connections: int = 20,
+                 keepalive_expiry: float = 30.0,
+                 timeout: float = 5.0,
+                 cache_ttl: float | None = None,
+                 cache_size: int = 1024,
+                 replicas: List[str] | None = None,
+                 readers: List[str] | None = None,
+                 binary: bool = False,
+                 uds: str | None = None,
+                 ):
+        """
+        Client for a mesh registry.
+
+        With `pooled=True`, requests go through a shared `httpx.Client` (and `httpx.AsyncClient` for the `a*` methods),
+        keeping connections alive between calls instead of opening one per request.
+
+        With `cache_ttl` set, discovery and tag search results are kept in a local LRU cache for that many seconds.
+        Call `watch` to also drop entries as soon as the registry reports a change to them.
+
+        With `replicas`, the URLs of a replicated registry, reads are spread over the replicas and writes go to the
+        leader, which is looked up again whenever a request fails.
+
+        With `readers`, the URLs of shared-memory snapshot readers (see `shared.start_readers`), service searches,
+        discoveries and key lookups are spread over them instead.
+
+        With `binary=True`, responses are requested in msgpack rather than JSON, which needs the msgpack package.
+
+        With `uds`, the path of the Unix socket a registry on the same host also listens on, requests to that registry
+        go through the socket whenever it exists, and over TCP otherwise.
+        """
+        if binary and encoding.msgpack is None:
+            raise ImportError("binary=True needs the msgpack package")
         self.server: Server | None = None
+        self.pooled = pooled
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(timeout)
+        self._client: httpx.Client | None = None
+        self._async_client: httpx.AsyncClient | None = None
+        self.uds = uds
+        self._uds_client: httpx.Client | None = None
+        self._async_uds_client: httpx.AsyncClient | None = None
+
+        self.cache = DiscoveryCache(cache_ttl, cache_size) if cache_ttl is not None else None
+        self.revision = 0
+        self._watcher: threading.Thread | None = None
+        self._stop_watching = threading.Event()
+
+        self.replica: MeshService | None = None
+        self._follower: threading.Thread | None = None
+        self._stop_following = threading.Event()
+
+        self.replicas = list(replicas or [])
+        self.leader: str | None = None
+        self._next_replica = 0
+        self.readers = list(readers or [])
+        self._next_reader = 0
+        self.accept = encoding.ACCEPT if binary else encoding.JSON
 
     def register(self, server: Server):
         self.server = server
 
-    def get_key_value(self, key: str):
-        request = httpx.get(f"{self.server.host}/kv/{key}")
-        request.raise_for_status()
-        return request.json()
+    @property
+    def client(self) -> httpx.Client:
+        if self._client is None:
+            self._client = httpx.Client(limits=self.limits, timeout=self.timeout)
+        return self._client
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+        return self._async_client
+
+    @property
+    def uds_client(self) -> httpx.Client:
+        if self._uds_client is None:
+            transport = httpx.HTTPTransport(uds=self.uds, limits=self.limits)
+            self._uds_client = httpx.Client(transport=transport, timeout=self.timeout)
+        return self._uds_client
+
+    @property
+    def async_uds_client(self) -> httpx.AsyncClient:
+        if self._async_uds_client is None:
+            transport = httpx.AsyncHTTPTransport(uds=self.uds, limits=self.limits)
+            self._async_uds_client = httpx.AsyncClient(transport=transport, timeout=self.timeout)
+        return self._async_uds_client
+
+    def close(self):
+        self.unwatch()
+        self.unfollow()
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+        if self._uds_client is not None:
+            self._uds_client.close()
+            self._uds_client = None
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+        if self._async_uds_client is not None:
+            await self._async_uds_client.aclose()
+            self._async_uds_client = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _base_url(self, method: str) -> str:
+        if method == "GET" and self.replicas:
+            self._next_replica = (self._next_replica + 1) % len(self.replicas)
+            return self.replicas[self._next_replica]
+        return self.leader or self.server.url
+
+    def _local(self, url: str) -> bool:
+        """Whether a request to `url` can go through the Unix socket of the registry."""
+        return (self.uds is not None and self.server is not None and url.startswith(self.server.url)
+                and os.path.exists(self.uds))
+
+    def _send(self, method: str, url: str, **kwargs) -> httpx.Response:
+        kwargs["headers"] = {"accept": self.accept, **kwargs.get("headers", {})}
+        response = None
+        if self._local(url):
+            try:
+                response = self.uds_client.request(method, url, **kwargs)
+            except httpx.ConnectError:
+                pass  # a socket left behind by a registry that is gone, nothing was sent
+        if response is None:
+            if self.pooled:
+                response = self.client.request(method, url, **kwargs)
+            else:
+                kwargs.setdefault("timeout", self.timeout)
+                response = httpx.request(method, url, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def _request(self, method: str, path: str, **kwargs):
+        try:
+            response = self._send(method, f"{self._base_url(method)}/{path}", **kwargs)
+        except httpx.HTTPError:
+            if not self.replicas:
+                raise
+            # the node may be down, or no longer the leader: retry once on the next replica or the new leader
+            if method != "GET":
+                self.leader = self.find_leader()
+            response = self._send(method, f"{self._base_url(method)}/{path}", **kwargs)
+        return encoding.decode(response)
+
+    def _read(self, path: str, revision: int = 0, **kwargs):
+        """
+        GET a lookup that snapshot readers can answer, falling back to the registry itself when they are unreachable
+        or their snapshot is older than `revision`.
+        """
+        if not self.readers:
+            return self._request("GET", path, **kwargs)
+        self._next_reader = (self._next_reader + 1) % len(self.readers)
+        try:
+            response = self._send("GET", f"{self.readers[self._next_reader]}/{path}", **kwargs)
+        except httpx.TransportError:
+            return self._request("GET", path, **kwargs)
+        if int(response.headers.get(encoding.REVISION, 0)) < revision:
+            return self._request("GET", path, **kwargs)
+        return encoding.decode(response)
+
+    async def _arequest(self, method: str, path: str, **kwargs):
+        kwargs["headers"] = {"accept": self.accept, **kwargs.get("headers", {})}
+        url = f"{self._base_url(method)}/{path}"
+        response = None
+        if self._local(url):
+            try:
+                response = await self.async_uds_client.request(method, url, **kwargs)
+            except httpx.ConnectError:
+                pass
+        if response is None:
+            response = await self.async_client.request(method, url, **kwargs)
+        response.raise_for_status()
+        return encoding.decode(response)
+
+    def find_leader(self) -> str | None:
+        """Ask the known nodes of a replicated registry which one currently accepts writes."""
+        for url in dict.fromkeys([self.server.url] + self.replicas):
+            try:
+                status = encoding.decode(self._send("GET", f"{url}/cluster/status"))
+            except httpx.HTTPError:
+                continue
+            if status["role"] == "leader":
+                return url
+            if status["leader"] is not None:
+                return status["leader"]
+        return None
+
+    def get_key_value(self, key: str, with_revision: bool = False):
+        if with_revision:
+            return self._request("GET", f"kv/{key}", params={"with_revision": with_revision})
+        return self._read(f"kv/{key}")
+
+    def set_key_value(self, key: str, value: Any, expected_revision: int | None = None):
+        return self._request("PUT", "kv", json={"key": key, "value": value, "expected_revision": expected_revision})
+
+    def get_key_values(self, keys: List[str]) -> dict:
+        return self._request("POST", "kv/get", json=list(keys))
+
+    def scan_key_values(self, prefix: str | None = None, start: str | None = None, end: str | None = None,
+                        limit: int = 100, cursor: str | None = None):
+        params = {"prefix": prefix, "start": start, "end": end, "limit": limit, "cursor": cursor}
+        return self._request("GET", "kv", params={k: v for k, v in params.items() if v is not None})
+
+    def iter_key_values(self, prefix: str | None = None, start: str | None = None, end: str | None = None,
+                        page_size: int = 1000):
+        """Iterate over every key-value pair in a namespace or range, one page per request."""
+        cursor = None
+        while True:
+            page = self.scan_key_values(prefix, start, end, page_size, cursor)
+            yield from page["items"]
+            cursor = page["cursor"]
+            if cursor is None:
+                break
 
-    def set_key_value(self, key: str, value: Any):
-        request = httpx.put(f"{self.server.url}/kv", json={"key": key, "value": value})
-        request.raise_for_status()
-        return request.json()
+    def compare_and_swap(self, key: str, value: Any, expected_revision: int) -> bool:
+        """Set `key` only if it is still at `expected_revision` (0 if it must not exist yet)."""
+        return self.set_key_value(key, value, expected_revision)["succeeded"]
+
+    def watch_key_value(self, key: str | None = None, prefix: str | None = None, since: int = 0,
+                        timeout: float = 30.0):
+        params = {"since": since, "timeout": timeout}
+        if key is not None:
+            params["key"] = key
+        if prefix is not None:
+            params["prefix"] = prefix
+        return self._request(
+            "GET", "watch/kv", params=params,
+            timeout=httpx.Timeout(self.timeout.connect, read=(self.timeout.read or 0) + timeout),
+        )
 
     def register_service(self, service: ServiceModel):
-        request = httpx.post(f"{self.server.url}/services", json=service.to_dict())
-        request.raise_for_status()
-        return request.json()
+        return self._request("POST", "services", json=service.to_dict())
+
+    def register_services(self, services: List[ServiceModel]):
+        return self._request("POST", "services/batch", json=[service.to_dict() for service in services])
+
+    def deregister_services(self, services: List[ServiceModel]):
+        return self._request("DELETE", "services/batch", json=[
+            {"name": service.name, "service_id": service.service_id} for service in services
+        ])
+
+    def heartbeat(self, name: str, service_id: str):
+        return self._request("PUT", f"services/{name}/{service_id}/heartbeat")
+
+    def _cached(self, key: tuple, path: str, **kwargs):
+        if self.cache is None:
+            return self._read(path, **kwargs)
+        value = self.cache.get(key)
+        if value is MISSING:
+            generation = self.cache.generation
+            # a snapshot from before the last change seen would be cached until it expires
+            value = self._read(path, self.revision, **kwargs)
+            self.cache.put(key, value, generation)
+        return value
 
     def search_services(self, tag: str):
-        request = httpx.get(f"{self.server.url}/services/search?tag={tag}")
-        request.raise_for_status()
-        return request.json()
+        return self._cached(("search", tag), "services/search", params={"tag": tag})
+
+    def query_services(self, expression: str, limit: int = 100, cursor: str | None = None, count_only: bool = False):
+        params = {"expression": expression, "limit": limit, "count_only": count_only}
+        if cursor is not None:
+            params["cursor"] = cursor
+        return self._request("GET", "services/query", params=params)
+
+    def iter_query(self, expression: str, page_size: int = 100):
+        """Iterate over every service matching `expression`, one page per request."""
+        cursor = None
+        while True:
+            page = self.query_services(expression, page_size, cursor)
+            yield from page["services"]
+            cursor = page["cursor"]
+            if cursor is None:
+                break
+
+    def get_services(self, name: str):
+        return self._read(f"services/{name}")
+
+    def discover_service(self, name: str, policy: str | None = None, count: int = 1):
+        if policy is not None:
+            # selections rotate between calls, so they are never cached
+            return self._request("GET", f"discovery/{name}", params={"policy": policy, "count": count})
+        return self._cached(("discovery", name), f"discovery/{name}")
+
+    def report_load(self, name: str, service_id: str, load: float):
+        return self._request("PUT", f"services/{name}/{service_id}/load", params={"load": load})
+
+    def cache_stats(self) -> dict | None:
+        return self.cache.stats() if self.cache is not None else None
+
+    def invalidate(self, changes: list):
+        """Drop cached lookups affected by a list of registry changes."""
+        keys = []
+        for change in changes:
+            if change["op"] not in ("register", "deregister", "health"):
+                continue
+            for service in change["services"]:
+                keys.append(("discovery", service["name"]))
+                keys.extend(("search", tag) for tag in service["tags"])
+        if keys:
+            self.cache.invalidate(keys)
+
+    def poll_changes(self, timeout: float = 0):
+        """Fetch changes since the last seen revision and apply them to the cache."""
+        response = self._request(
+            "GET", "changes", params={"since": self.revision, "timeout": timeout},
+            timeout=httpx.Timeout(self.timeout.connect, read=(self.timeout.read or 0) + timeout),
+        )
+        if response["reset"]:
+            self.cache.clear()
+        else:
+            self.invalidate(response["changes"])
+        self.revision = response["revision"]
+
+    def watch(self, timeout: float = 30.0, retry: float = 1.0):
+        """Invalidate the cache from registry change notifications in a background thread."""
+        if self.cache is None:
+            raise ValueError("Watching changes requires a cache, set cache_ttl")
+        if self._watcher is not None:
+            return
+
+        def loop():
+            while not self._stop_watching.is_set():
+                try:
+                    self.poll_changes(timeout)
+                except httpx.HTTPError:
+                    # changes may have been missed while unreachable
+                    self.cache.clear()
+                    self._stop_watching.wait(retry)
+
+        self._stop_watching.clear()
+        self._watcher = threading.Thread(target=loop, daemon=True)
+        self._watcher.start()
+
+    def unwatch(self):
+        if self._watcher is not None:
+            self._stop_watching.set()
+            self._watcher = None
+
+    def sync(self, timeout: float = 0) -> MeshService:
+        """
+        Bring the local `replica` of the registry up to date, applying only the changes since its last sync, or the
+        full state if it fell too far behind.
+        """
+        if self.replica is None:
+            self.replica = MeshService(self.server.url, "replica", replica=True)
+        response = self._request(
+            "GET", "sync", params={"since": self.replica.changes.revision, "timeout": timeout},
+            timeout=httpx.Timeout(self.timeout.connect, read=(self.timeout.read or 0) + timeout),
+        )
+        self.replica.apply_sync(response)
+        return self.replica
+
+    def follow(self, timeout: float = 30.0, retry: float = 1.0):
+        """Keep the local `replica` up to date from a background thread."""
+        if self._follower is not None:
+            return
+
+        def loop():
+            while not self._stop_following.is_set():
+                try:
+                    self.sync(timeout)
+                except httpx.HTTPError:
+                    self._stop_following.wait(retry)
+
+        self._stop_following.clear()
+        self._follower = threading.Thread(target=loop, daemon=True)
+        self._follower.start()
+
+    def unfollow(self):
+        if self._follower is not None:
+            self._stop_following.set()
+            self._follower = None
+
+    async def aget_key_value(self, key: str, with_revision: bool = False):
+        return await self._arequest("GET", f"kv/{key}", params={"with_revision": with_revision})
+
+    async def aset_key_value(self, key: str, value: Any, expected_revision: int | None = None):
+        return await self._arequest(
+            "PUT", "kv", json={"key": key, "value": value, "expected_revision": expected_revision}
+        )
+
+    async def aregister_service(self, service: ServiceModel):
+        return await self._arequest("POST", "services", json=service.to_dict())
+
+    async def aheartbeat(self, name: str, service_id: str):
+        return await self._arequest("PUT", f"services/{name}/{service_id}/heartbeat")
+
+    async def asearch_services(self, tag: str):
+        return await self._arequest("GET", "services/search", params={"tag": tag})
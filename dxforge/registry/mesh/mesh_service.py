@@ -1,102 +1,574 @@
+import asyncio
+import sys
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
 from dataclasses import dataclass
-from typing import List, Any, Dict, Tuple, Set
+from typing import List, Any, Dict, Set, Tuple
 
 from dxlib.interfaces.services import Service, HttpEndpoint
+from fastapi import APIRouter
+from starlette.requests import Request
 
+from . import query
+from .balance import Balancer
+from .changes import ChangeLog
+from .encoding import respond
+from .lease import TimingWheel
+from .persistence import Persistence
 
-@dataclass
+
+@dataclass(slots=True)
 class ServiceModel:
     name: str
     service_id: str
     endpoints: str
     tags: List[str]
+    ttl: float | None = None  # lease in seconds, renewed by heartbeats; None registers until deregistered
+    weight: int = 1  # relative share of traffic under the weighted discovery policy
+    check: str | None = None  # "http" probes GET {endpoints}/health, "tcp" connects to the endpoint; None never probes
+    check_interval: float | None = None  # seconds between probes, None for the health checker's default
+
+    def __post_init__(self):
+        # a fleet shares a handful of names and tags, keep a single copy of each
+        self.name = sys.intern(self.name)
+        self.tags = [sys.intern(tag) for tag in self.tags]
 
     def to_dict(self):
         return {
             "service_id": self.service_id,
             "name": self.name,
             "endpoints": self.endpoints,
-            "tags": self.tags
+            "tags": self.tags,
+            "ttl": self.ttl,
+            "weight": self.weight,
+            "check": self.check,
+            "check_interval": self.check_interval,
         }
 
 
-@dataclass
+@dataclass(slots=True)
+class ServiceKey:
+    name: str
+    service_id: str
+
+
+@dataclass(slots=True)
 class KeyValue:
     key: str
     value: Any
+    expected_revision: int | None = None  # compare-and-swap: only set if the key is at this revision, 0 if absent
 
 
 class MeshService(Service):
-    def __init__(self, name, service_id):
+    def __init__(self, name, service_id, lease_tick: float = 1.0, data_dir: str | None = None,
+                 snapshot_every: int = 10000, replica: bool = False):
+        """
+        With `data_dir` set, every mutation is written to a write-ahead log there and acknowledged once it is on disk,
+        the state is snapshotted every `snapshot_every` changes, and a restarted registry recovers from both.
+
+        A `replica` only mirrors changes applied from another registry: it does not expire leases itself, since
+        the expiries arrive as deregistrations.
+        """
         super().__init__(name, service_id)
         self.kv_store = {}
+        self.kv_revisions: Dict[str, int] = {}  # key -> revision of its last change
+        self.kv_keys: List[str] = []  # sorted, for prefix and range scans
         self.services: Dict[str, Dict[str, ServiceModel]] = {}  # service name -> {service id -> instance}
         self.tagged: Dict[str, Set[Tuple[str, str]]] = {}  # tag -> set of (name, id)
         self.service_index: Dict[Tuple[str, str], ServiceModel] = {}
+        self.unhealthy: Set[Tuple[str, str]] = set()  # instances failing their health checks
+        self.changes = ChangeLog()
+        self.lock = threading.RLock()
+        self.leases = TimingWheel(lease_tick, start=time.monotonic())
+        self._reaper: threading.Thread | None = None
+        self.balancer = Balancer()
+        self.replica = replica
+        self.cluster = None  # set by a `Cluster` replicating this registry
 
-    @HttpEndpoint.post("services")
-    def register_service(self, service: ServiceModel):
-        if service.name not in self.services:
-            self.services[service.name] = {}
-        self.services[service.name][service.service_id] = service
+        # long-polls wait on the event loop instead of holding one of the server's worker threads each,
+        # `HttpEndpoint` only serves sync handlers so they are routed here
+        self.router = APIRouter()
+        self.router.add_api_route("/changes", self.get_changes, methods=["GET"])
+        self.router.add_api_route("/sync", self.sync, methods=["GET"])
+        self.router.add_api_route("/watch/kv", self.watch_key_value, methods=["GET"])
+
+        self.persistence: Persistence | None = None
+        self.snapshot_every = snapshot_every
+        self._snapshot_revision = 0
+        self._snapshotting = False
+        if data_dir is not None:
+            self._recover(Persistence(data_dir))
+
+    def _recover(self, persistence: Persistence):
+        snapshot, changes = persistence.load()
+        with self.lock:
+            if snapshot is not None:
+                self.load_state(snapshot)
+                self._snapshot_revision = snapshot["revision"]
+            for change in changes:
+                self.apply(change)
+        persistence.start()
+        self.persistence = persistence
+
+    def state(self) -> dict:
+        """Serializable copy of the registry at the current revision."""
+        with self.lock:
+            return {
+                "revision": self.changes.revision,
+                "services": [service.to_dict() for service in self.service_index.values()],
+                "unhealthy": [list(key) for key in self.unhealthy],
+                "kv": [
+                    {"key": key, "value": value, "revision": self.kv_revisions[key]}
+                    for key, value in self.kv_store.items()
+                ],
+            }
+
+    def load_state(self, state: dict):
+        """Replace the whole registry with a `state()` copy."""
+        with self.lock:
+            # the rebuild is not a sequence of real changes, persist it as a snapshot instead
+            persistence, self.persistence = self.persistence, None
+            self._deregister(list(self.service_index))
+            self._register([ServiceModel(**service) for service in state["services"]])
+            self.unhealthy = {tuple(key) for key in state.get("unhealthy", [])}
+            self.kv_store = {entry["key"]: entry["value"] for entry in state["kv"]}
+            self.kv_revisions = {entry["key"]: entry["revision"] for entry in state["kv"]}
+            self.kv_keys = sorted(self.kv_store)
+            self.changes.reset(state["revision"])
+
+            self.persistence = persistence
+            if persistence is not None:
+                persistence.rotate(state["revision"])
+                persistence.save_snapshot(state)
+                self._snapshot_revision = state["revision"]
+
+    def apply_sync(self, response: dict):
+        """Apply a response of the `sync` endpoint of another registry."""
+        with self.lock:
+            # a concurrent sync may already have applied part of the response
+            if "snapshot" in response:
+                if response["revision"] != self.changes.revision:
+                    self.load_state(response["snapshot"])
+            else:
+                for change in response["changes"]:
+                    if change["revision"] > self.changes.revision:
+                        self.apply(change)
 
-        self.service_index[(service.name, service.service_id)] = service
+    def apply(self, change: dict):
+        """Replay a change recorded by another registry, or by this one before a restart."""
+        with self.lock:
+            if change["op"] == "register":
+                self._register([ServiceModel(**service) for service in change["services"]])
+            elif change["op"] == "deregister":
+                self._deregister([(service["name"], service["service_id"]) for service in change["services"]])
+            elif change["op"] == "health":
+                self._set_health([(service["name"], service["service_id"]) for service in change["services"]],
+                                 change["healthy"])
+            elif change["op"] == "kv_set":
+                self._set_key_value(change["key"], change["value"])
 
-        for tag in service.tags:
+    def promote(self):
+        """Start accepting writes and expiring leases, after replicating another registry."""
+        with self.lock:
+            self.replica = False
+            now = time.monotonic()
+            for key, service in self.service_index.items():
+                if service.ttl is not None:
+                    self.leases.schedule(key, now + service.ttl)
+            self._start_reaper()
+
+    def demote(self):
+        """Stop accepting writes, to replicate another registry."""
+        with self.lock:
+            self.replica = True
+            for key in list(self.leases.deadlines):
+                self.leases.cancel(key)
+
+    def _check_writable(self):
+        if self.replica:
+            leader = self.cluster.leader if self.cluster is not None else None
+            raise Exception(f"Read-only replica, send writes to the leader: {leader}")
+
+    def snapshot(self):
+        """Write a snapshot of the current state and drop the log it makes obsolete."""
+        with self.lock:
+            state = self.state()
+            self.persistence.rotate(state["revision"])
+        self.persistence.save_snapshot(state)
+        self._snapshot_revision = state["revision"]
+
+    def _commit(self, op: str, **payload) -> dict:
+        change = self.changes.append(op, **payload)
+        if self.persistence is not None:
+            self.persistence.append(change)
+            if change["revision"] - self._snapshot_revision >= self.snapshot_every and not self._snapshotting:
+                self._snapshotting = True
+                threading.Thread(target=self._background_snapshot, daemon=True).start()
+        return change
+
+    def _background_snapshot(self):
+        try:
+            self.snapshot()
+        finally:
+            self._snapshotting = False
+
+    def _durable(self):
+        """Wait until every change made so far is persisted, grouped with concurrent writers into one sync."""
+        if self.persistence is not None:
+            self.persistence.wait(self.changes.revision)
+
+    def _register(self, services: List[ServiceModel]):
+        """Index a list of instances in a single pass over `tagged`. Callers must hold the lock."""
+        tagged: Dict[str, List[Tuple[str, str]]] = {}
+        for service in services:
+            key = (service.name, service.service_id)
+            if key in self.service_index:
+                self._untag({tag: [key] for tag in self.service_index[key].tags})
+            self.unhealthy.discard(key)
+
+            if service.name not in self.services:
+                self.services[service.name] = {}
+            self.services[service.name][service.service_id] = service
+            self.service_index[key] = service
+
+            if service.ttl is not None and not self.replica:
+                self.leases.schedule(key, time.monotonic() + service.ttl)
+            else:
+                self.leases.cancel(key)
+
+            for tag in service.tags:
+                if tag not in tagged:
+                    tagged[tag] = []
+                tagged[tag].append(key)
+
+        for tag, keys in tagged.items():
             if tag not in self.tagged:
                 self.tagged[tag] = set()
-            self.tagged[tag].add((service.name, service.service_id))
+            self.tagged[tag].update(keys)
+        self._commit("register", services=[service.to_dict() for service in services])
+        self._start_reaper()
+
+    def _deregister(self, keys: List[Tuple[str, str]]) -> List[ServiceModel]:
+        """Remove a list of instances in a single pass over `tagged`. Callers must hold the lock."""
+        removed = []
+        untagged: Dict[str, List[Tuple[str, str]]] = {}
+        for key in keys:
+            service = self.service_index.pop(key, None)
+            if service is None:
+                continue
+            self.leases.cancel(key)
+            self.balancer.forget(key)
+            self.unhealthy.discard(key)
+            name, service_id = key
+            del self.services[name][service_id]
+            if not self.services[name]:
+                del self.services[name]
+
+            for tag in service.tags:
+                if tag not in untagged:
+                    untagged[tag] = []
+                untagged[tag].append(key)
+            removed.append(service)
+
+        self._untag(untagged)
+        if removed:
+            self._commit("deregister", services=[
+                {"name": service.name, "service_id": service.service_id, "tags": service.tags} for service in removed
+            ])
+        return removed
+
+    def _start_reaper(self):
+        if self._reaper is None and len(self.leases):
+            self._reaper = threading.Thread(target=self._expire_leases, daemon=True)
+            self._reaper.start()
+
+    def _expire_leases(self):
+        while True:
+            time.sleep(self.leases.tick)
+            with self.lock:
+                expired = self.leases.advance(time.monotonic())
+                if expired:
+                    self._deregister(expired)
+
+    def set_health(self, keys: List[Tuple[str, str]], healthy: bool):
+        """Mark registered instances as passing or failing their health checks."""
+        with self.lock:
+            self._set_health(keys, healthy)
+
+    def _set_health(self, keys: List[Tuple[str, str]], healthy: bool):
+        changed = [
+            self.service_index[key] for key in keys
+            if key in self.service_index and (key in self.unhealthy) == healthy
+        ]
+        if not changed:
+            return
+        if healthy:
+            self.unhealthy.difference_update((service.name, service.service_id) for service in changed)
+        else:
+            self.unhealthy.update((service.name, service.service_id) for service in changed)
+        self._commit("health", healthy=healthy, services=[
+            {"name": service.name, "service_id": service.service_id, "tags": service.tags} for service in changed
+        ])
+
+    def _healthy(self, services: List[ServiceModel]) -> List[ServiceModel]:
+        if not self.unhealthy:
+            return services
+        return [service for service in services if (service.name, service.service_id) not in self.unhealthy]
+
+    def _set_key_value(self, key: str, value: Any):
+        if key not in self.kv_store:
+            insort(self.kv_keys, key)
+        self.kv_store[key] = value
+        self.kv_revisions[key] = self._commit("kv_set", key=key, value=value)["revision"]
+
+    def _untag(self, untagged: Dict[str, List[Tuple[str, str]]]):
+        for tag, keys in untagged.items():
+            if tag in self.tagged:
+                self.tagged[tag].difference_update(keys)
+                if not self.tagged[tag]:
+                    del self.tagged[tag]
+
+    @HttpEndpoint.post("services")
+    def register_service(self, service: ServiceModel):
+        with self.lock:
+            self._check_writable()
+            self._register([service])
+        self._durable()
         return service
 
+    @HttpEndpoint.post("services/batch")
+    def register_services(self, services: List[ServiceModel]):
+        """Register a list of service instances atomically."""
+        keys = {(service.name, service.service_id) for service in services}
+        if len(keys) != len(services):
+            raise ValueError("Duplicate service instances in batch")
+        with self.lock:
+            self._check_writable()
+            self._register(services)
+        self._durable()
+        return {"registered": len(services)}
+
+    @HttpEndpoint.delete("services/batch")
+    def deregister_services(self, services: List[ServiceKey]):
+        """Deregister a list of service instances atomically."""
+        with self.lock:
+            self._check_writable()
+            removed = self._deregister([(service.name, service.service_id) for service in services])
+        self._durable()
+        return {"deregistered": len(removed)}
+
     @HttpEndpoint.get("services/search")
-    def search_services(self, tag: str):
+    def search_services(self, tag: str, request: Request = None):
         """Search for service by tag."""
-        result = [self.service_index[(name, service_id)] for name, service_id in self.tagged.get(tag, set())]
+        with self.lock:
+            result = self._healthy([self.service_index[key] for key in self.tagged.get(tag, set())])
         if not result:
             raise Exception("No service found with the given tag")
-        return result
+        return respond(result, request)
+
+    @HttpEndpoint.get("services/query")
+    def query_services(self, expression: str, limit: int = 100, cursor: str | None = None, count_only: bool = False,
+                       request: Request = None):
+        """
+        Search for services matching a boolean tag expression, e.g. `a AND b AND NOT c`.
+        Results are ordered by (name, id) and paged with the returned `cursor`.
+        """
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        node = query.parse(expression)
+        with self.lock:
+            keys = query.evaluate(node, self.tagged, self.service_index.keys())
+            if self.unhealthy:
+                keys = keys - self.unhealthy
+            if count_only:
+                return {"count": len(keys)}
+            selected, next_cursor = query.page(keys, limit, cursor)
+            return respond({
+                "count": len(keys),
+                "services": [self.service_index[key] for key in selected],
+                "cursor": next_cursor,
+            }, request)
 
     @HttpEndpoint.get("services/{name}")
-    def get_services(self, name: str):
+    def get_services(self, name: str, request: Request = None):
         """Get all instances of a service by name."""
-        if name not in self.services:
-            raise Exception("Service not found")
-        return list(self.services.get(name, {}).values())
+        with self.lock:
+            if name not in self.services:
+                raise Exception("Service not found")
+            instances = list(self.services[name].values())
+        return respond(instances, request)
 
-    @HttpEndpoint.delete("services/{name}/{id}")
+    @HttpEndpoint.delete("services/{name}/{service_id}")
     def deregister_service(self, name: str, service_id: str):
         """Deregister a service instance by name and ID."""
-        if name in self.services and service_id in self.services[name]:
-            service = self.services[name].pop(service_id)
-            if not self.services[name]:
-                del self.services[name]
+        with self.lock:
+            self._check_writable()
+            self._deregister([(name, service_id)])
+        self._durable()
 
-            del self.service_index[(name, service_id)]
+        return {"message": "Service deregistered successfully"}
 
-            for tag in service.tags:
-                if tag in self.tagged:
-                    self.tagged[tag].remove((name, service_id))
-                    if not self.tagged[tag]:
-                        del self.tagged[tag]
+    @HttpEndpoint.put("services/{name}/{service_id}/heartbeat")
+    def heartbeat(self, name: str, service_id: str):
+        """Renew the lease of a service instance."""
+        key = (name, service_id)
+        with self.lock:
+            self._check_writable()
+            if key not in self.service_index:
+                raise Exception("Service not found")
+            ttl = self.service_index[key].ttl
+            if ttl is not None:
+                self.leases.schedule(key, time.monotonic() + ttl)
+        return {"ttl": ttl}
 
-        return {"message": "Service deregistered successfully"}
+    @HttpEndpoint.put("services/{name}/{service_id}/load")
+    def report_load(self, name: str, service_id: str, load: float):
+        """Report the current load of a service instance, used by the p2c discovery policy."""
+        key = (name, service_id)
+        with self.lock:
+            self._check_writable()
+            if key not in self.service_index:
+                raise Exception("Service not found")
+            self.balancer.report(key, load)
+        return {"load": load}
 
     @HttpEndpoint.get("discovery/{name}")
-    def discover_service(self, name: str):
-        """Discover endpoints for a given service name."""
-        if name not in self.services:
-            raise Exception("Service not found")
-        return list(self.services.get(name, {}).values())
+    def discover_service(self, name: str, policy: str | None = None, count: int = 1, request: Request = None):
+        """
+        Discover endpoints for a given service name.
+        With a `policy` (round_robin, weighted or p2c), only the `count` instances to use are returned, best first.
+        """
+        if count < 1:
+            raise ValueError("count must be positive")
+        with self.lock:
+            if name not in self.services:
+                raise Exception("Service not found")
+            instances = self._healthy(list(self.services[name].values()))
+            if not instances:
+                raise Exception("No healthy instance of the service")
+            if policy is not None:
+                instances = self.balancer.select(name, instances, policy, count)
+        return respond(instances, request)
+
+    async def get_changes(self, since: int = 0, timeout: float = 0, request: Request = None):
+        """
+        Registry changes after revision `since`, waiting up to `timeout` seconds (capped at a minute) for one.
+        `reset` is set when the requested changes were already dropped from the history.
+        """
+        if since > self.changes.revision:
+            changes = None
+        elif timeout > 0:
+            changes = await self.changes.await_change(since, min(timeout, 60.0))
+        else:
+            changes = self.changes.since(since)
+        if changes is None:
+            return {"revision": self.changes.revision, "changes": [], "reset": True}
+        return respond(
+            {"revision": changes[-1]["revision"] if changes else since, "changes": changes, "reset": False}, request
+        )
+
+    @HttpEndpoint.get("cluster/status")
+    def cluster_status(self):
+        """Role of this registry and where writes should go."""
+        if self.cluster is not None:
+            return self.cluster.status()
+        return {"url": None, "role": "follower" if self.replica else "leader", "leader": None,
+                "revision": self.changes.revision}
+
+    async def sync(self, since: int = 0, timeout: float = 0, request: Request = None):
+        """
+        Changes after revision `since` to bring a replica up to date, waiting up to `timeout` seconds (capped at a
+        minute) for one. When those changes are no longer retained, the full `snapshot` is returned instead.
+        """
+        if since <= self.changes.revision:
+            if timeout > 0:
+                changes = await self.changes.await_change(since, min(timeout, 60.0))
+            else:
+                changes = self.changes.since(since)
+            if changes is not None:
+                return respond({"revision": changes[-1]["revision"] if changes else since, "changes": changes}, request)
+        # copying the whole registry waits on the lock, keep it off the event loop
+        state = await asyncio.to_thread(self.state)
+        return respond({"revision": state["revision"], "snapshot": state}, request)
 
     @HttpEndpoint.put("kv")
     def set_key_value(self, data: KeyValue):
-        """Set a key-value pair."""
-        self.kv_store[data.key] = data.value
-        return data
+        """Set a key-value pair, optionally only if the key is still at `expected_revision`."""
+        with self.lock:
+            self._check_writable()
+            revision = self.kv_revisions.get(data.key, 0)
+            if data.expected_revision is not None and data.expected_revision != revision:
+                return {"key": data.key, "value": self.kv_store.get(data.key), "revision": revision, "succeeded": False}
+            self._set_key_value(data.key, data.value)
+            revision = self.kv_revisions[data.key]
+        self._durable()
+        return {"key": data.key, "value": data.value, "revision": revision, "succeeded": True}
+
+    @HttpEndpoint.get("kv")
+    def scan_key_values(self, prefix: str | None = None, start: str | None = None, end: str | None = None,
+                        limit: int = 100, cursor: str | None = None, request: Request = None):
+        """
+        List key-value pairs in key order, restricted to keys under `prefix` and/or in [`start`, `end`).
+        Continue with the returned `cursor` until it is null.
+        """
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        lower = max(start or "", prefix or "")
+        with self.lock:
+            index = bisect_left(self.kv_keys, lower)
+            if cursor is not None:
+                index = max(index, bisect_right(self.kv_keys, cursor))
+
+            items = []
+            for key in self.kv_keys[index:index + limit + 1]:
+                if (prefix is not None and not key.startswith(prefix)) or (end is not None and key >= end):
+                    break
+                items.append({"key": key, "value": self.kv_store[key], "revision": self.kv_revisions[key]})
+        if len(items) > limit:
+            items = items[:limit]
+            return respond({"items": items, "cursor": items[-1]["key"]}, request)
+        return respond({"items": items, "cursor": None}, request)
 
-    @HttpEndpoint.get("kv/{key}")
-    def get_key_value(self, key: str):
+    @HttpEndpoint.post("kv/get")
+    def get_key_values(self, keys: List[str], request: Request = None):
+        """Retrieve the values of several keys at once, leaving out missing ones."""
+        with self.lock:
+            return respond({key: self.kv_store[key] for key in keys if key in self.kv_store}, request)
+
+    @HttpEndpoint.get("kv/{key:path}")
+    def get_key_value(self, key: str, with_revision: bool = False, request: Request = None):
         """Retrieve a value by key."""
-        if key not in self.kv_store:
-            raise Exception("Key not found")
-        return self.kv_store[key]
+        with self.lock:
+            if key not in self.kv_store:
+                raise Exception("Key not found")
+            if with_revision:
+                return respond({"key": key, "value": self.kv_store[key], "revision": self.kv_revisions[key]}, request)
+            return respond(self.kv_store[key], request)
+
+    async def watch_key_value(self, key: str | None = None, prefix: str | None = None, since: int = 0,
+                        timeout: float = 30.0):
+        """
+        Wait up to `timeout` seconds (capped at a minute) for changes to `key`, or to any key under `prefix`, made
+        after revision `since`. Resume from the returned `revision`; `reset` means changes were missed and the keys
+        should be read again.
+        """
+        deadline = time.monotonic() + min(timeout, 60.0)
+        revision = since
+        while True:
+            if revision > self.changes.revision:
+                return {"revision": self.changes.revision, "events": [], "reset": True}
+            changes = await self.changes.await_change(revision, max(deadline - time.monotonic(), 0))
+            if changes is None:
+                return {"revision": self.changes.revision, "events": [], "reset": True}
+            events = [
+                {"key": change["key"], "value": change["value"], "revision": change["revision"]}
+                for change in changes
+                if change["op"] == "kv_set"
+                and (key is None or change["key"] == key)
+                and (prefix is None or change["key"].startswith(prefix))
+            ]
+            if changes:
+                revision = changes[-1]["revision"]
+            if events or time.monotonic() >= deadline:
+                return {"revision": revision, "events": events, "reset": False}
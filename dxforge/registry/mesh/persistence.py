@@ -0,0 +1,118 @@
+import json
+import os
+import threading
+from pathlib import Path
+from typing import List, Tuple
+
+
+class Persistence:
+    """
+    Durable registry state as a snapshot plus a write-ahead log of the changes made after it.
+
+    Changes are appended by a single writer thread, which writes and fsyncs everything queued since its last flush in
+    one go, so concurrent writers share the cost of a sync. The log is split into segments named after their first
+    revision; a snapshot at revision R makes every segment that ends at or before R obsolete.
+    """
+
+    def __init__(self, directory: str | os.PathLike, fsync: bool = True):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.fsync = fsync
+        self.snapshot_path = self.directory / "snapshot.json"
+
+        self.condition = threading.Condition()
+        self.pending: List[dict] = []
+        self.flushed = 0
+        self.segment = None
+        self._rotate_at: int | None = None
+        self._writer: threading.Thread | None = None
+
+    def segments(self) -> List[Tuple[int, Path]]:
+        return sorted((int(path.stem.split("-")[1]), path) for path in self.directory.glob("wal-*.jsonl"))
+
+    def load(self) -> Tuple[dict | None, List[dict]]:
+        """The last snapshot, if any, and the logged changes that came after it, in order."""
+        snapshot = None
+        if self.snapshot_path.exists():
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+        revision = snapshot["revision"] if snapshot else 0
+
+        changes = []
+        for _, path in self.segments():
+            with open(path) as f:
+                for line in f:
+                    try:
+                        change = json.loads(line)
+                    except json.JSONDecodeError:
+                        # torn write at the tail of the log
+                        break
+                    if change["revision"] > revision:
+                        changes.append(change)
+        self.flushed = changes[-1]["revision"] if changes else revision
+        return snapshot, changes
+
+    def start(self):
+        if self._writer is None:
+            self._open(self.flushed + 1)
+            self._writer = threading.Thread(target=self._write, daemon=True)
+            self._writer.start()
+
+    def append(self, change: dict):
+        with self.condition:
+            self.pending.append(change)
+            self.condition.notify_all()
+
+    def wait(self, revision: int, timeout: float | None = None) -> bool:
+        """Block until every change up to `revision` is on disk."""
+        with self.condition:
+            return self.condition.wait_for(lambda: self.flushed >= revision, timeout)
+
+    def rotate(self, revision: int):
+        """Start a new segment for the changes after `revision`, which must be the last appended one."""
+        with self.condition:
+            self._rotate_at = revision
+            self.condition.notify_all()
+            self.condition.wait_for(lambda: self._rotate_at is None)
+
+    def save_snapshot(self, snapshot: dict):
+        """Atomically replace the snapshot and drop the log segments it covers."""
+        tmp = self.snapshot_path.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump(snapshot, f)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp, self.snapshot_path)
+
+        segments = self.segments()
+        for (_, path), (start, _) in zip(segments, segments[1:]):
+            if start <= snapshot["revision"] + 1:
+                path.unlink()
+
+    def _open(self, revision: int):
+        if self.segment is not None:
+            self.segment.close()
+        self.segment = open(self.directory / f"wal-{revision:012d}.jsonl", "a")
+
+    def _write(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending or self._rotate_at is not None)
+                batch, self.pending = self.pending, []
+
+            for change in batch:
+                self.segment.write(json.dumps(change) + "\n")
+            self.segment.flush()
+            if self.fsync:
+                os.fsync(self.segment.fileno())
+
+            with self.condition:
+                if batch:
+                    self.flushed = batch[-1]["revision"]
+                if self._rotate_at is not None and not self.pending:
+                    # nothing is appended while rotating, so the log is complete up to the rotation point
+                    self.flushed = max(self.flushed, self._rotate_at)
+                    self._open(self._rotate_at + 1)
+                    self._rotate_at = None
+                self.condition.notify_all()
@@ -0,0 +1,136 @@
+import base64
+import heapq
+import json
+import re
+from typing import AbstractSet, Dict, List, Set, Tuple
+
+Key = Tuple[str, str]
+
+TOKEN = re.compile(r"\s*(\(|\)|[^\s()]+)")
+KEYWORDS = {"AND", "OR", "NOT"}
+
+
+def parse(expression: str):
+    """
+    Parse a tag expression such as `a AND (b OR c) AND NOT d` into nested tuples:
+    ("tag", name), ("not", node), ("and", [nodes]) or ("or", [nodes]).
+    NOT binds tighter than AND, which binds tighter than OR. Keywords are case-insensitive.
+    """
+    tokens = TOKEN.findall(expression)
+    position = 0
+
+    def peek():
+        return tokens[position].upper() if position < len(tokens) else None
+
+    def take():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def parse_or():
+        nodes = [parse_and()]
+        while peek() == "OR":
+            take()
+            nodes.append(parse_and())
+        return nodes[0] if len(nodes) == 1 else ("or", nodes)
+
+    def parse_and():
+        nodes = [parse_unary()]
+        while peek() == "AND":
+            take()
+            nodes.append(parse_unary())
+        return nodes[0] if len(nodes) == 1 else ("and", nodes)
+
+    def parse_unary():
+        token = peek()
+        if token == "NOT":
+            take()
+            return "not", parse_unary()
+        if token == "(":
+            take()
+            node = parse_or()
+            if peek() != ")":
+                raise ValueError(f"Unbalanced parentheses in query: {expression!r}")
+            take()
+            return node
+        if token is None or token == ")" or token in KEYWORDS:
+            raise ValueError(f"Expected a tag in query: {expression!r}")
+        return "tag", take()
+
+    if not tokens:
+        raise ValueError("Empty query expression")
+    node = parse_or()
+    if position != len(tokens):
+        raise ValueError(f"Unexpected {tokens[position]!r} in query: {expression!r}")
+    return node
+
+
+def evaluate(node, tagged: Dict[str, Set[Key]], universe: AbstractSet[Key]) -> AbstractSet[Key]:
+    """
+    Evaluate a parsed expression over the tag index. Conjunctions start from their smallest operand and subtract
+    negated operands last, so the universe is only touched by top-level or purely negative terms.
+    The returned set may be one of the index sets, so it must not be mutated.
+    """
+    kind, value = node
+    if kind == "tag":
+        return tagged.get(value, set())
+    if kind == "not":
+        return universe - evaluate(value, tagged, universe)
+    if kind == "or":
+        return set().union(*(evaluate(child, tagged, universe) for child in value))
+
+    positive = [child for child in value if child[0] != "not"]
+    negative = [child[1] for child in value if child[0] == "not"]
+    if positive:
+        operands = sorted(positive, key=lambda child: estimate(child, tagged, len(universe)))
+        result = evaluate(operands[0], tagged, universe)
+        for child in operands[1:]:
+            if not result:
+                return set()
+            result = result & evaluate(child, tagged, universe)
+    else:
+        result = universe
+    for child in negative:
+        if not result:
+            break
+        result = result - evaluate(child, tagged, universe)
+    return result
+
+
+def estimate(node, tagged: Dict[str, Set[Key]], total: int) -> int:
+    """Upper bound on the size of a node's result, used to order conjunctions."""
+    kind, value = node
+    if kind == "tag":
+        return len(tagged.get(value, ()))
+    if kind == "not":
+        return total
+    if kind == "or":
+        return min(total, sum(estimate(child, tagged, total) for child in value))
+    return min(estimate(child, tagged, total) for child in value)
+
+
+def encode_cursor(key: Key) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Key:
+    try:
+        name, service_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return name, service_id
+
+
+def page(keys: AbstractSet[Key], limit: int, cursor: str | None = None) -> Tuple[List[Key], str | None]:
+    """
+    The `limit` smallest keys after `cursor`, and the cursor for the next page if there is one.
+    Selects with a bounded heap rather than sorting the whole result.
+    """
+    if cursor is not None:
+        after = decode_cursor(cursor)
+        keys = (key for key in keys if key > after)
+    selected = heapq.nsmallest(limit + 1, keys)
+    if len(selected) > limit:
+        selected = selected[:limit]
+        return selected, encode_cursor(selected[-1])
+    return selected, None
@@ -0,0 +1,220 @@
+import multiprocessing
+import pickle
+import socket
+import struct
+import threading
+import time
+from multiprocessing.shared_memory import SharedMemory
+from typing import List
+
+from dxlib.interfaces.services import Service, HttpEndpoint
+from dxlib.interfaces.servers.http.fastapi import FastApiServer
+from starlette.requests import Request
+
+from .encoding import respond
+from .mesh_service import MeshService
+
+HEAD = struct.Struct("QQ")  # version, written twice so a torn read can be detected
+LENGTH = struct.Struct("Q")
+
+
+def _attach(name: str) -> SharedMemory:
+    # only the publisher owns the segments, readers must not unlink them when they exit
+    try:
+        return SharedMemory(name, track=False)
+    except TypeError:
+        # before 3.13 attaching registers with the resource tracker, which readers started by `start_readers` share
+        # with the publisher, so the segments are still only unlinked once
+        return SharedMemory(name)
+
+
+class SnapshotPublisher:
+    """
+    Publishes immutable, versioned snapshots of a `MeshService`'s read state into shared memory.
+
+    Each version is a new segment holding the pickled lookup tables used by `SnapshotService`, and a small head
+    segment holds the latest version number. Bursts of changes are coalesced into one version every `interval`
+    seconds, or twice as long as the last publish took if that is longer, so a large registry spends at most about a
+    third of its time publishing. Readers lag the writer by about that much.
+    """
+
+    def __init__(self, mesh: MeshService, prefix: str = "dxforge-mesh", interval: float = 0.05):
+        self.mesh = mesh
+        self.prefix = prefix
+        self.interval = interval
+        self.version = 0
+        self.head = SharedMemory(f"{prefix}-head", create=True, size=HEAD.size)
+        HEAD.pack_into(self.head.buf, 0, 0, 0)
+        self.segments: List[SharedMemory] = []
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def tables(self) -> dict:
+        # only references are copied under the lock, instances are replaced rather than changed so they stay valid;
+        # flat copies allocate a single object, a list of item tuples can set off a full garbage collection
+        with self.mesh.lock:
+            revision = self.mesh.changes.revision
+            instances = dict(self.mesh.service_index)
+            unhealthy = set(self.mesh.unhealthy)
+            kv = dict(self.mesh.kv_store)
+
+        services = {}
+        healthy = {}
+        tagged = {}
+        for key, service in instances.items():
+            data = service.to_dict()
+            services.setdefault(service.name, []).append(data)
+            if key in unhealthy:
+                continue
+            healthy.setdefault(service.name, []).append(data)
+            for tag in service.tags:
+                tagged.setdefault(tag, []).append(data)
+        return {"revision": revision, "services": services, "discovery": healthy, "tagged": tagged, "kv": kv}
+
+    def publish(self):
+        payload = pickle.dumps(self.tables(), protocol=pickle.HIGHEST_PROTOCOL)
+        version = self.version + 1
+        segment = SharedMemory(f"{self.prefix}-{version}", create=True, size=LENGTH.size + len(payload))
+        LENGTH.pack_into(segment.buf, 0, len(payload))
+        segment.buf[LENGTH.size:LENGTH.size + len(payload)] = payload
+        HEAD.pack_into(self.head.buf, 0, version, version)
+        self.version = version
+
+        # keep the previous version around for readers that are still attaching to it
+        self.segments.append(segment)
+        while len(self.segments) > 2:
+            old = self.segments.pop(0)
+            old.close()
+            old.unlink()
+
+    def start(self):
+        if self._thread is None:
+            self.publish()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        revision = self.mesh.changes.revision
+        cost = 0.0
+        while not self._stop.is_set():
+            self.mesh.changes.wait(revision, 1.0)
+            if self.mesh.changes.revision != revision:
+                time.sleep(max(self.interval, 2 * cost))
+                revision = self.mesh.changes.revision
+                start = time.perf_counter()
+                self.publish()
+                cost = time.perf_counter() - start
+
+    def close(self):
+        self._stop.set()
+        for segment in self.segments + [self.head]:
+            segment.close()
+            segment.unlink()
+        self.segments = []
+
+
+class SnapshotReader:
+    """Reader side of `SnapshotPublisher`: decodes each published version once and shares it between requests."""
+
+    def __init__(self, prefix: str = "dxforge-mesh"):
+        self.prefix = prefix
+        self.head = _attach(f"{prefix}-head")
+        self.version = 0
+        self.tables = {"revision": 0, "services": {}, "discovery": {}, "tagged": {}, "kv": {}}
+        self.lock = threading.Lock()
+
+    def current(self) -> dict:
+        first, second = HEAD.unpack_from(self.head.buf, 0)
+        if first == second and first != self.version:
+            with self.lock:
+                if first != self.version:
+                    self._load(first)
+        return self.tables
+
+    def _load(self, version: int):
+        try:
+            segment = _attach(f"{self.prefix}-{version}")
+        except FileNotFoundError:
+            # superseded while we were looking, the next read picks up the newer version
+            return
+        try:
+            length, = LENGTH.unpack_from(segment.buf, 0)
+            with segment.buf[LENGTH.size:LENGTH.size + length] as payload:
+                self.tables = pickle.loads(payload)
+            self.version = version
+        finally:
+            segment.close()
+
+
+class SnapshotService(Service):
+    """Read-only registry endpoints served from the latest shared-memory snapshot."""
+
+    def __init__(self, reader: SnapshotReader, leader: str | None = None):
+        super().__init__("dxforge-snapshot", "snapshot")
+        self.reader = reader
+        self.leader = leader
+
+    @HttpEndpoint.get("services/search")
+    def search_services(self, tag: str, request: Request = None):
+        """Search for service by tag."""
+        tables = self.reader.current()
+        result = tables["tagged"].get(tag)
+        if not result:
+            raise Exception("No service found with the given tag")
+        return respond(result, request, tables["revision"])
+
+    @HttpEndpoint.get("services/{name}")
+    def get_services(self, name: str, request: Request = None):
+        """Get all instances of a service by name."""
+        tables = self.reader.current()
+        if name not in tables["services"]:
+            raise Exception("Service not found")
+        return respond(tables["services"][name], request, tables["revision"])
+
+    @HttpEndpoint.get("discovery/{name}")
+    def discover_service(self, name: str, request: Request = None):
+        """Discover endpoints for a given service name."""
+        tables = self.reader.current()
+        if name not in tables["services"]:
+            raise Exception("Service not found")
+        if name not in tables["discovery"]:
+            raise Exception("No healthy instance of the service")
+        return respond(tables["discovery"][name], request, tables["revision"])
+
+    @HttpEndpoint.get("kv/{key:path}")
+    def get_key_value(self, key: str, request: Request = None):
+        """Retrieve a value by key."""
+        tables = self.reader.current()
+        if key not in tables["kv"]:
+            raise Exception("Key not found")
+        return respond(tables["kv"][key], request, tables["revision"])
+
+    @HttpEndpoint.get("cluster/status")
+    def cluster_status(self):
+        """Role of this registry and where writes should go."""
+        return {"url": None, "role": "follower", "leader": self.leader, "revision": self.reader.current()["revision"]}
+
+
+def serve_snapshots(prefix: str, host: str, port: int, leader: str | None = None):
+    """Serve a `SnapshotService` on a port shared with the other reader processes (Linux SO_REUSEPORT)."""
+    # an explicit protocol, otherwise asyncio does not set TCP_NODELAY on accepted connections
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+
+    server = FastApiServer(host=host, port=port, log_level="warning")
+    server.register(SnapshotService(SnapshotReader(prefix), leader))
+    server.run(sockets=[sock])
+
+
+def start_readers(prefix: str, host: str, port: int, workers: int, leader: str | None = None):
+    """Start `workers` reader processes sharing one port, to spread reads over that many cores."""
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=serve_snapshots, args=(prefix, host, port, leader), daemon=True)
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    return processes
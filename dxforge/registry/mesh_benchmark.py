@@ -0,0 +1,300 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import httpx
+
+OPERATIONS = ("register", "deregister", "search", "discover", "kv_get", "kv_set")
+DEFAULT_MIX = "register=5,deregister=5,search=30,discover=40,kv_get=15,kv_set=5"
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """Parse `op=weight,...` into relative weights, e.g. `search=3,discover=1`."""
+    weights = {}
+    for part in mix.split(","):
+        op, _, weight = part.partition("=")
+        op = op.strip()
+        if op not in OPERATIONS:
+            raise ValueError(f"Unknown operation '{op}', expected one of {', '.join(OPERATIONS)}")
+        weights[op] = float(weight or 1)
+    if not any(weights.values()):
+        raise ValueError("The operation mix needs at least one positive weight")
+    return weights
+
+
+def percentile(latencies: List[float], q: float) -> float | None:
+    """Nearest-rank percentile of sorted latencies."""
+    if not latencies:
+        return None
+    return latencies[max(0, math.ceil(q * len(latencies)) - 1)]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "latency": {
+            "mean": sum(latencies) / len(latencies) if latencies else None,
+            "p50": percentile(latencies, 0.50),
+            "p99": percentile(latencies, 0.99),
+            "p999": percentile(latencies, 0.999),
+            "max": latencies[-1] if latencies else None,
+        },
+    }
+
+
+def free_port(host: str) -> int:
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+class Registry:
+    """A registry node in its own process, so the load generator does not compete with it for the GIL."""
+
+    def __init__(self, host: str = "127.0.0.1", data_dir: str | None = None):
+        self.host = host
+        self.port = free_port(host)
+        self.url = f"http://{host}:{self.port}"
+        command = [sys.executable, "-m", "dxforge.registry.mesh_registry", "--host", host, "--port", str(self.port)]
+        if data_dir:
+            command += ["--data-dir", data_dir]
+        self.process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def wait(self, timeout: float = 30.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Registry exited with code {self.process.returncode}")
+            try:
+                httpx.get(f"{self.url}/cluster/status", timeout=1.0).raise_for_status()
+                return
+            except httpx.HTTPError:
+                time.sleep(0.1)
+        raise TimeoutError(f"Registry did not start within {timeout} seconds")
+
+    def stop(self):
+        self.process.send_signal(signal.SIGTERM)
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+    def __enter__(self):
+        self.wait()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+class Workload:
+    """
+    The fleet and keys a benchmark run works on.
+
+    Instances are spread over `fleet_size / instances_per_service` service names and `tags` tags. Registrations only
+    add instances that are currently absent and deregistrations only remove present ones, so with equal weights for
+    both the fleet stays around its initial size. Searches and discoveries ask for the tag or service of a present
+    instance, so churn emptying a tag on a small fleet does not show up as errors.
+    """
+
+    def __init__(self, fleet_size: int, instances_per_service: int = 10, tags: int = 100, keys: int = 1000,
+                 seed: int = 0):
+        self.fleet_size = fleet_size
+        self.services = max(1, fleet_size // instances_per_service)
+        self.tags = max(1, min(tags, fleet_size))
+        self.keys = keys
+        self.rng = random.Random(seed)
+
+        self.present = list(range(fleet_size))
+        self.absent: List[int] = []
+        self._next = fleet_size
+
+    def service(self, i: int) -> dict:
+        return {
+            "name": f"service-{i % self.services}",
+            "service_id": f"instance-{i}",
+            "endpoints": f"http://10.0.{i // 256 % 256}.{i % 256}:8080",
+            "tags": [f"tag-{i % self.tags}", f"zone-{i % 3}"],
+        }
+
+    def add(self) -> int:
+        if self.absent:
+            i = self.absent.pop()
+        else:
+            i, self._next = self._next, self._next + 1
+        self.present.append(i)
+        return i
+
+    def remove(self) -> int | None:
+        if not self.present:
+            return None
+        # swap with the last one so removal stays constant time on large fleets
+        j = self.rng.randrange(len(self.present))
+        self.present[j], self.present[-1] = self.present[-1], self.present[j]
+        i = self.present.pop()
+        self.absent.append(i)
+        return i
+
+    def sample(self) -> int:
+        """A present instance, or any one if the fleet is empty."""
+        if not self.present:
+            return self.rng.randrange(self.fleet_size or 1)
+        return self.present[self.rng.randrange(len(self.present))]
+
+    def request(self, op: str) -> tuple:
+        """Method, path and request arguments for one operation."""
+        if op == "register":
+            return "POST", "services", {"json": self.service(self.add())}
+        if op == "deregister":
+            i = self.remove()
+            if i is None:
+                return self.request("register")
+            service = self.service(i)
+            return "DELETE", f"services/{service['name']}/{service['service_id']}", {}
+        if op == "search":
+            return "GET", "services/search", {"params": {"tag": f"tag-{self.sample() % self.tags}"}}
+        if op == "discover":
+            return "GET", f"discovery/service-{self.sample() % self.services}", {}
+        if op == "kv_get":
+            return "GET", f"kv/bench/{self.rng.randrange(self.keys)}", {}
+        if op == "kv_set":
+            key = f"bench/{self.rng.randrange(self.keys)}"
+            return "PUT", "kv", {"json": {"key": key, "value": self.rng.random()}}
+        raise ValueError(f"Unknown operation '{op}'")
+
+
+async def preload(client: httpx.AsyncClient, workload: Workload, batch_size: int = 1000):
+    """Register the initial fleet and write every key once."""
+    for start in range(0, workload.fleet_size, batch_size):
+        services = [workload.service(i) for i in range(start, min(start + batch_size, workload.fleet_size))]
+        (await client.post("services/batch", json=services)).raise_for_status()
+    for key in range(workload.keys):
+        (await client.put("kv", json={"key": f"bench/{key}", "value": 0})).raise_for_status()
+
+
+async def drive(client: httpx.AsyncClient, workload: Workload, weights: Dict[str, float], concurrency: int,
+                duration: float, warmup: float = 0.0) -> dict:
+    """Run `concurrency` workers issuing operations picked from `weights` for `duration` seconds."""
+    ops, cumulative = list(weights), list(weights.values())
+    latencies: Dict[str, List[float]] = {op: [] for op in ops}
+    errors: Dict[str, int] = {op: 0 for op in ops}
+
+    start = time.perf_counter()
+    measure_from = start + warmup
+    deadline = measure_from + duration
+
+    async def worker():
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                return
+            op = workload.rng.choices(ops, cumulative)[0]
+            method, path, kwargs = workload.request(op)
+            try:
+                response = await client.request(method, path, **kwargs)
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            end = time.perf_counter()
+            if now < measure_from:
+                continue
+            if failed:
+                errors[op] += 1
+            else:
+                latencies[op].append(end - now)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - measure_from
+
+    result = summarize([latency for op in ops for latency in latencies[op]], sum(errors.values()), elapsed)
+    result["operations"] = {op: summarize(latencies[op], errors[op], elapsed) for op in ops}
+    return result
+
+
+async def benchmark(url: str, fleet_size: int, weights: Dict[str, float], concurrency: int, duration: float,
+                    warmup: float, **workload) -> dict:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30.0) as client:
+        workload = Workload(fleet_size, **workload)
+        started = time.perf_counter()
+        await preload(client, workload)
+        preload_time = time.perf_counter() - started
+
+        result = await drive(client, workload, weights, concurrency, duration, warmup)
+    return {"fleet_size": fleet_size, "concurrency": concurrency, "preload_seconds": preload_time, **result}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a local mesh registry")
+    parser.add_argument("--fleet-sizes", type=int, nargs="+", default=[10, 1000, 10000, 100000],
+                        help="Number of registered instances to benchmark at, each against a fresh registry")
+    parser.add_argument("--mix", type=str, default=DEFAULT_MIX,
+                        help=f"Relative weight of each operation, from {', '.join(OPERATIONS)}")
+    parser.add_argument("--concurrency", type=int, default=64, help="Number of requests kept in flight")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds measured at each fleet size")
+    parser.add_argument("--warmup", type=float, default=1.0, help="Seconds of load before measuring")
+    parser.add_argument("--instances-per-service", type=int, default=10)
+    parser.add_argument("--tags", type=int, default=100, help="Number of distinct tags over the fleet")
+    parser.add_argument("--keys", type=int, default=1000, help="Number of distinct KV keys")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--data-dir", type=str, help="Benchmark a durable registry writing under this directory")
+    parser.add_argument("--output", type=str, help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    weights = parse_mix(args.mix)
+    if args.data_dir:
+        os.makedirs(args.data_dir, exist_ok=True)
+    report = {
+        "config": {
+            "mix": weights,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "instances_per_service": args.instances_per_service,
+            "tags": args.tags,
+            "keys": args.keys,
+            "seed": args.seed,
+            "durable": args.data_dir is not None,
+            "python": sys.version.split()[0],
+        },
+        "results": [],
+    }
+
+    for fleet_size in args.fleet_sizes:
+        # a fresh directory per run, so a durable registry does not recover the previous run's fleet
+        data_dir = tempfile.mkdtemp(prefix=f"fleet-{fleet_size}-", dir=args.data_dir) if args.data_dir else None
+        with Registry(args.host, data_dir) as registry:
+            result = asyncio.run(benchmark(
+                registry.url, fleet_size, weights, args.concurrency, args.duration, args.warmup,
+                instances_per_service=args.instances_per_service, tags=args.tags, keys=args.keys, seed=args.seed,
+            ))
+        report["results"].append(result)
+        print(f"fleet={fleet_size} throughput={result['throughput']:.0f}/s "
+              f"p50={result['latency']['p50']} p99={result['latency']['p99']} errors={result['errors']}",
+              file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,37 +1,95 @@
+import argparse
+import os
 import signal
 import sys
 import threading
 import time
 
+import uvicorn
 from dxlib.interfaces.servers.http.fastapi import FastApiServer
 
 from dxforge.registry.mesh import MeshService, MeshInterface
+from dxforge.registry.mesh.cluster import Cluster
+from dxforge.registry.mesh.health import HealthChecker
 from dxforge.registry.mesh.mesh_service import ServiceModel
+from dxforge.registry.mesh.shared import SnapshotPublisher, start_readers
 
-if __name__ == "__main__":
-    mesh = MeshService("dxforge", "forge-one")
-    server = FastApiServer(host="127.0.0.1", port=5000)
-    server.register(mesh)
-    mesh_interface = MeshInterface()
+
+def demo(server):
+    mesh_interface = MeshInterface(pooled=True)
     mesh_interface.register(server)
 
+    time.sleep(1)
+    service = ServiceModel("MyService", "my-service-1", endpoints="http://localhost:5000", tags=["greeter"])
+    mesh_interface.register_service(service)
+
+    print(mesh_interface.search_services("greeter"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a mesh registry node")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--data-dir", type=str, help="Directory for the write-ahead log and snapshots")
+    parser.add_argument("--peers", type=str, nargs="*",
+                        help="URLs of every node of a replicated registry, in failover priority order")
+    parser.add_argument("--readers", type=int, default=0,
+                        help="Number of processes serving lookups from shared-memory snapshots")
+    parser.add_argument("--read-port", type=int, default=5100, help="Port shared by the reader processes")
+    parser.add_argument("--check-interval", type=float, default=10.0,
+                        help="Default seconds between health checks of instances registered with one")
+    parser.add_argument("--check-concurrency", type=int, default=256, help="Maximum health checks in flight")
+    parser.add_argument("--uds", type=str,
+                        help="Also listen on this Unix socket, for clients on the same host or in mounted containers")
+    parser.add_argument("--demo", action="store_true", help="Register and search a service, then exit")
+    args = parser.parse_args()
+
+    mesh = MeshService("dxforge", f"forge-{args.port}", data_dir=args.data_dir)
+    server = FastApiServer(host=args.host, port=args.port)
+    server.register(mesh)
+
+    if args.peers:
+        Cluster(mesh, server.url, args.peers).start()
+    HealthChecker(mesh, interval=args.check_interval, concurrency=args.check_concurrency).start()
+
+    publisher = None
+    if args.readers:
+        publisher = SnapshotPublisher(mesh, prefix=f"dxforge-mesh-{args.port}")
+        publisher.start()
+        start_readers(publisher.prefix, args.host, args.read_port, args.readers, leader=server.url)
+
     t = threading.Thread(target=server.run)
     t.start()
 
+    local = None
+    if args.uds:
+        # a second listener for the same app, so both transports serve the same registry
+        local = uvicorn.Server(uvicorn.Config(server.app, uds=args.uds, log_level=server.config.log_level))
+        threading.Thread(target=local.run, daemon=True).start()
+
+    def shutdown():
+        if local is not None:
+            local.should_exit = True
+            if os.path.exists(args.uds):
+                os.remove(args.uds)
+        if publisher is not None:
+            publisher.close()
+
     def signal_handler(sig, frame):
+        server.should_exit = True
+        t.join()
+        shutdown()
         sys.exit(0)
 
     signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
 
-    try:
-        time.sleep(1)
-        service = ServiceModel("MyService", "my-service-1", endpoints="http://localhost:5000", tags=["greeter"])
-        mesh_interface.register_service(service)
-
-        print(mesh_interface.search_services("greeter"))
-
+    if args.demo:
+        demo(server)
         server.should_exit = True
-        t.join()
+    t.join()
+    shutdown()
 
-    except KeyboardInterrupt:
-        sys.exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,73 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Request
 from pydantic import BaseModel, Field
 from typing import Dict
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, StreamingResponse
 from apscheduler.triggers.cron import CronTrigger
-from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.schedulers.background import BackgroundScheduler
+import asyncio
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from dxforge.orchestrator import Orchestrator
 
-router = APIRouter()
-
-jobstores = {'default': SQLAlchemyJobStore(url='sqlite:///jobs.sqlite')}
-scheduler = BackgroundScheduler(jobstores=jobstores)
-scheduler.start()
-orchestrator = Orchestrator()
+_scheduler = None
+_scheduler_lock = threading.Lock()
 job_registry: Dict[str, str] = {}
 
+
+def get_scheduler() -> BackgroundScheduler:
+    """The job scheduler, started with its SQLite job store on first use."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore  # SQLAlchemy is slow to import
+
+            jobstores = {'default': SQLAlchemyJobStore(url='sqlite:///jobs.sqlite')}
+            _scheduler = BackgroundScheduler(jobstores=jobstores)
+            _scheduler.start()
+        return _scheduler
+
+
+def get_orchestrator() -> Orchestrator:
+    return Orchestrator()
+
+
+def watch_containers():
+    get_orchestrator().watch()
+
+
+def archive_logs():
+    from docker.errors import DockerException
+
+    try:
+        get_orchestrator().archive()
+    except DockerException as e:
+        print(f"[Scheduler] Could not archive running containers' logs: {e}")
+
+
+def warm_pools():
+    from docker.errors import DockerException
+
+    # scheduled runs take a warm container when their config sets `container.pool`
+    for name, config in strategy_store.items():
+        try:
+            get_orchestrator().warm(config)
+        except (OSError, DockerException) as e:
+            # DockerException covers a failed image build (BuildError) and an unreachable daemon
+            print(f"[Scheduler] Could not warm a pool for {name}: {e}")
+
+
+def close_pools():
+    get_orchestrator().close_pools()
+
+
 strategy_store = {
     "wick": "examples/wick/config.yaml",
 }
 
+# persisted jobs must fire without waiting for a request, so the scheduler starts with the app rather than on import
+router = APIRouter(on_startup=[get_scheduler, watch_containers, warm_pools, archive_logs], on_shutdown=[close_pools])
+
 class Schedule(BaseModel):
     name: str = Field(
         ...,
@@ -42,7 +90,7 @@ def list_strategies():
 
 def run_strategy_job(strategy_name: str):
     print(f"[Scheduler] Running strategy: {strategy_name}")
-    orchestrator.run(strategy_store[strategy_name])
+    get_orchestrator().run(strategy_store[strategy_name])
 
 @router.post("/schedule")
 def schedule_strategy(schedule: Schedule):
@@ -56,7 +104,7 @@ def schedule_strategy(schedule: Schedule):
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-    scheduler.add_job(
+    get_scheduler().add_job(
         run_strategy_job,
         trigger,
         id=job_id,
@@ -68,6 +116,7 @@ def schedule_strategy(schedule: Schedule):
 
 @router.get("/schedules")
 def list_schedules():
+    scheduler = get_scheduler()
     jobs = scheduler.get_jobs()
     result = []
     for job in jobs:
@@ -84,30 +133,95 @@ def list_schedules():
 def delete_schedule(job_id: str):
     if job_id not in job_registry:
         raise HTTPException(status_code=404, detail="Job not found")
-    scheduler.remove_job(job_id)
+    get_scheduler().remove_job(job_id)
     del job_registry[job_id]
     return {"detail": "Job deleted"}
 
 @router.delete("/strategy/{container_name}")
 def delete(container_name: str):
-    removed = orchestrator.remove(container_name)
+    removed = get_orchestrator().remove(container_name)
     return {"detail": "Removed" if removed else "Removed"}
 
 @router.post("/run")
 def run_strategy(action: Action):
     if action.name not in strategy_store:
         raise HTTPException(status_code=404, detail="Strategy not found")
-    container_name = orchestrator.run(strategy_store[action.name])
+    container_name = get_orchestrator().run(strategy_store[action.name])
     return {"detail": f"Started {action.name} with container {container_name}"}
 
 @router.post("/stop")
 def stop_strategy(action: Action):
     if action.name not in strategy_store:
         raise HTTPException(status_code=404, detail="Strategy not found")
-    scheduler.pause_job(action.name)
-    orchestrator.stop(action.name)
+    get_scheduler().pause_job(action.name)
+    get_orchestrator().stop(action.name)
+
+@router.get("/status")
+def fleet_status():
+    return get_orchestrator().status()
+
+async def read_logs(request: Request, chunks, poll: float = 1.0):
+    """
+    Chunks of a `LogStream`, read by a thread of its own: a follow blocks on the daemon for as long as the container
+    is quiet, and in the shared threadpool would starve the sync endpoints. The stream is closed when the client
+    disconnects, which ends the blocked read.
+    """
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=1)
+    iterator = iter(chunks)
+    try:
+        while True:
+            pending = loop.run_in_executor(executor, next, iterator, None)
+            while not (await asyncio.wait({pending}, timeout=poll))[0]:
+                if await request.is_disconnected():
+                    return
+            chunk = pending.result()
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        chunks.close()
+        executor.shutdown(wait=False)
+
+
+async def server_sent_events(chunks):
+    # one event per log line, a line split across chunks is held until it is complete
+    partial = ""
+    async for chunk in chunks:
+        *lines, partial = (partial + chunk).split("\n")
+        for line in lines:
+            yield f"data: {line}\n\n"
+    if partial:
+        yield f"data: {partial}\n\n"
+
 
 @router.get("/logs")
-def log_strategy(name: str = Query(..., description="Name of the strategy")):
-    logs = orchestrator.logs(name)
-    return logs
+async def log_strategy(
+        request: Request,
+        name: str = Query(..., description="Name of the strategy"),
+        tail: int | None = Query(None, ge=0, description="Only return the last N lines"),
+        since: float | None = Query(None, gt=0, description="Only return logs after this epoch timestamp"),
+        until: float | None = Query(None, gt=0, description="Only return logs before this epoch timestamp"),
+        follow: bool = Query(False, description="Keep the response open and stream new logs"),
+        sse: bool = Query(False, description="Send the logs as server-sent events, one per line"),
+):
+    chunks = await asyncio.to_thread(
+        get_orchestrator().stream_logs,
+        name, tail=tail if tail is not None else "all", since=since, until=until, follow=follow,
+    )
+    if chunks is None:
+        raise HTTPException(status_code=404, detail="Container not found")
+    chunks = read_logs(request, chunks)
+    if sse:
+        return StreamingResponse(server_sent_events(chunks), media_type="text/event-stream")
+    return StreamingResponse(chunks, media_type="text/plain; charset=utf-8")
+
+
+@router.get("/logs/archive")
+def archived_logs(
+        name: str = Query(..., description="Name of the container"),
+        since: float | None = Query(None, description="Only return logs after this epoch timestamp"),
+        until: float | None = Query(None, description="Only return logs before this epoch timestamp"),
+):
+    lines = get_orchestrator().archived_logs(name, since, until)
+    return StreamingResponse(lines, media_type="text/plain; charset=utf-8")
@@ -0,0 +1,52 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# generous bounds for a slow machine, well below what connecting to Docker or starting the scheduler takes
+CLI_BUDGET = 1.0
+APP_BUDGET = 2.0
+HEAVY = ("docker", "sqlalchemy", "apscheduler.jobstores.sqlalchemy")
+
+PROBE = """
+import json, runpy, sys, time
+start = time.perf_counter()
+{body}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "modules": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def probe(body, cwd):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(ROOT), os.environ.get("PYTHONPATH", "")]))
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(body=body, heavy=HEAVY)],
+        cwd=cwd, env=env, capture_output=True, text=True, timeout=60,
+    )
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_cli_help_is_fast_and_lazy(tmp_path):
+    body = (
+        "sys.argv = ['dxforge.orchestrator', '--help']\n"
+        "try:\n"
+        "    runpy.run_module('dxforge.orchestrator', run_name='__main__')\n"
+        "except SystemExit:\n"
+        "    pass"
+    )
+    result = probe(body, tmp_path)
+    assert result["seconds"] < CLI_BUDGET
+    assert result["modules"] == []
+    assert not (tmp_path / ".state").exists()
+
+
+def test_app_import_is_fast_and_lazy(tmp_path):
+    result = probe("import dxforge.__main__", tmp_path)
+    assert result["seconds"] < APP_BUDGET
+    assert result["modules"] == []
+    assert not (tmp_path / ".state").exists()
+    assert not (tmp_path / "jobs.sqlite").exists()